@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+import sys,argparse,math,time
+from collections import OrderedDict as odict
+from multiprocessing.pool import ThreadPool
+
+import xbmcsim
+from xbmcrpc import XBMCException,Controller,Coalescer,discover
+
+################################################################################
+# Recorded input                                                               #
+################################################################################
+
+def key_hold(duration=2.0,delay=0.5,rate=30):
+  """key press times (in seconds) for holding a key with X11 auto-repeat"""
+
+  # the first press, then auto-repeat after the delay at the given rate
+  times = [0.0]
+  t = delay
+  while t<duration:
+    times.append(round(t,3))
+    t += 1.0/rate
+  return times
+
+################################################################################
+# Benchmarks                                                                   #
+################################################################################
+
+def percentile(values,p):
+  """the nearest-rank p-th percentile of a list of numbers"""
+
+  values = sorted(values)
+  return values[max(0,int(math.ceil(p/100.0*len(values)))-1)]
+
+def start_sim(args,**kwargs):
+  """start a simulator with the latency options and return (sim,servers)"""
+
+  sim = xbmcsim.Sim(latency=args.latency/1000.0,jitter=args.jitter/1000.0,
+                    failure=args.failure,seed=0,**kwargs)
+  return (sim,xbmcsim.serve(sim,'127.0.0.1',0,0))
+
+def controller(port,tcp=9090,notify=False,transport='get'):
+  """a Controller for the simulator with the same defaults as the GUI"""
+
+  opts = {'xbmc_ip':'127.0.0.1:%i' % port,'xbmc_user':'','xbmc_pass':'',
+          'timeout_conn':3.05,'timeout_read':10,'use_notify':int(notify),
+          'xbmc_tcp':tcp,'transport':transport,'pid_ttl':2,'rel_cmds':1,
+          'step_back':10,'step_fore':10,'def_plist':0}
+  ctrl = Controller(opts)
+
+  # wait for the notifier to sync the state model
+  if notify:
+    end = time.time()+5
+    while not ctrl.state.synced and time.time()<end:
+      time.sleep(0.01)
+
+  # warm up the connection, version check and player id cache
+  ctrl.relative()
+  ctrl.xpid()
+  return ctrl
+
+def replay(sim,port,times,coalesce):
+  """press Fore at the given times; return (requests,lag,final position)"""
+
+  ctrl = controller(port)
+  coalescer = Coalescer(ctrl)
+  step = int(ctrl.opts['step_fore'])
+
+  # a pool of 4 threads like the QThreadPool in the GUI
+  pool = ThreadPool(4)
+  sim.set_time(0)
+  start = sim.requests
+  t0 = time.time()
+  for t in times:
+    time.sleep(max(0,t0+t-time.time()))
+    if not coalesce:
+      pool.apply_async(ctrl.hop,('fore',))
+    elif coalescer.press('seek',step):
+      pool.apply_async(coalescer.flush,('seek',))
+
+  # lag is how long after the key was released the player caught up
+  released = time.time()
+  pool.close()
+  pool.join()
+  lag = time.time()-released
+  ctrl.close()
+  return (sim.requests-start,lag,sim.elapsed())
+
+def bench_keyhold(args):
+  """replay a key-hold burst with and without coalescing"""
+
+  (sim,servers) = start_sim(args,length=86400)
+  sim.speed = 0
+  port = servers[0].server_address[1]
+
+  times = key_hold(args.duration)
+  print('Key hold: %i presses over %.1f s, %i ms simulated latency' %
+      (len(times),args.duration,args.latency))
+  print('%-10s %8s %10s %10s' % ('mode','RPCs','lag (ms)','position'))
+  for (name,coalesce) in (('direct',False),('coalesced',True)):
+    (rpcs,lag,pos) = replay(sim,port,times,coalesce)
+    print('%-10s %8i %10.0f %10i' % (name,rpcs,lag*1000,pos))
+
+  for server in servers:
+    server.shutdown()
+
+# actions as the GUI buttons and dialogs call them; alternating arguments keep
+# the player in the middle of the video, playlist and volume range
+ACTIONS = odict([
+  ('playpause',   lambda c,i: c.playpause()),
+  ('hop',         lambda c,i: c.hop(('fore','back')[i%2])),
+  ('jump',        lambda c,i: c.jump(('next','prev')[i%2])),
+  ('volume',      lambda c,i: c.volume(('up','down')[i%2])),
+  ('get_info',    lambda c,i: c.get_info()),
+  ('get_playlist',lambda c,i: c.get_playlist()),
+])
+
+def run_action(sim,ctrl,func,count):
+  """call func count times; return (latencies,requests,errors)"""
+
+  times = []
+  errors = 0
+  start = sim.requests
+  for i in range(count):
+    t0 = time.time()
+    try:
+      func(ctrl,i)
+    except XBMCException:
+      errors += 1
+    times.append(time.time()-t0)
+
+  # count the requests the notifier makes in response too
+  settle(sim)
+  return (times,sim.requests-start,errors)
+
+def settle(sim,quiet=0.2):
+  """wait until the simulator has seen no requests for quiet seconds"""
+
+  last = None
+  while sim.requests!=last:
+    last = sim.requests
+    time.sleep(quiet+sim.latency+sim.jitter)
+
+def bench_actions(args):
+  """time every action with the polling controller and with notifications"""
+
+  print('Actions: %i calls each over %s, %i ms latency, %i ms jitter, '
+      '%.0f%% failures' % (args.count,args.transport,args.latency,args.jitter,
+      args.failure*100))
+  print('%-8s %-13s %8s %8s %8s %8s %7s' %
+      ('mode','action','p50 (ms)','p95 (ms)','p99 (ms)','RPCs','errors'))
+
+  for (mode,notify) in (('polling',False),('notify',True)):
+    (sim,servers) = start_sim(args,length=86400,items=10)
+    sim.position = 5
+    (http,tcp) = [server.server_address[1] for server in servers]
+    ctrl = controller(http,tcp,notify,args.transport)
+
+    for (name,func) in ACTIONS.items():
+      (times,rpcs,errors) = run_action(sim,ctrl,func,args.count)
+      ms = [percentile(times,p)*1000 for p in (50,95,99)]
+      print('%-8s %-13s %8.1f %8.1f %8.1f %8.2f %7i' %
+          tuple([mode,name]+ms+[float(rpcs)/args.count,errors]))
+
+    ctrl.close()
+    for server in servers:
+      server.shutdown()
+
+def bench_pipeline(args):
+  """send many requests at once over each transport"""
+
+  (sim,servers) = start_sim(args)
+  (http,tcp) = [server.server_address[1] for server in servers]
+  print('Pipeline: %i pings from %i threads, %i ms latency' %
+      (args.count,args.threads,args.latency))
+  print('%-10s %10s %10s' % ('transport','total (ms)','per call'))
+
+  for transport in ('get','post','tcp'):
+    ctrl = controller(http,tcp,False,transport)
+    pool = ThreadPool(args.threads)
+    t0 = time.time()
+    pool.map(lambda i: ctrl.xbmc('JSONRPC.Ping'),range(args.count))
+    total = time.time()-t0
+    print('%-10s %10.0f %10.1f' % (transport,total*1000,total*1000/args.count))
+    pool.close()
+    ctrl.close()
+
+  for server in servers:
+    server.shutdown()
+
+def bench_discover(args):
+  """scan the loopback /24 for several simulators on different ports"""
+
+  # the simulators' ports plus as many where nothing listens
+  sims = [start_sim(args) for i in range(args.hosts)]
+  ports = [servers[0].server_address[1] for (sim,servers) in sims]
+  port_range = ','.join([str(p) for p in sorted(ports+[p+1 for p in ports])])
+
+  t0 = time.time()
+  first = None
+  (probes,found) = (0,[])
+  for (target,status) in discover('127.0.0.0/24',port_range):
+    probes += 1
+    if status is not None:
+      found.append(target)
+      first = first or time.time()-t0
+  total = time.time()-t0
+
+  print('Discovery: 127.0.0.0/24 ports %s, %i simulators' % (port_range,args.hosts))
+  print('%i probes, found %i in %.2f s (first after %.2f s)' %
+      (probes,len(found),total,first or 0))
+
+  for (sim,servers) in sims:
+    for server in servers:
+      server.shutdown()
+
+################################################################################
+# Main                                                                         #
+################################################################################
+
+def main(args):
+
+  parser = argparse.ArgumentParser(description='benchmark remote actions')
+  parser.add_argument('--latency',type=float,default=50,help='delay per request (ms)')
+  parser.add_argument('--jitter',type=float,default=0,help='extra random delay (ms)')
+  parser.add_argument('--failure',type=float,default=0,help='HTTP failure rate (0-1)')
+  parser.add_argument('--duration',type=float,default=2,help='key hold time (s)')
+  parser.add_argument('--count',type=int,default=50,help='calls per action')
+  parser.add_argument('--hosts',type=int,default=3,help='simulators to discover')
+  parser.add_argument('--transport',default='get',choices=['get','post','tcp'],
+      help='transport for the actions')
+  parser.add_argument('--threads',type=int,default=32,help='pipelining threads')
+  names = ['keyhold','actions','pipeline','discover']
+  parser.add_argument('bench',nargs='*',
+      help='benchmarks to run: %s (default all)' % ', '.join(names))
+  args = parser.parse_args(args[1:])
+
+  # names are checked here since argparse also checks a list default
+  for name in args.bench:
+    if name not in names:
+      parser.error('unknown benchmark: %s' % name)
+  args.bench = args.bench or names
+
+  for name in args.bench:
+    globals()['bench_'+name](args)
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -1,30 +1,14 @@
 #!/usr/bin/env python
 
-import sys,json,os,argparse,inspect,math,socket
-from ConfigParser import SafeConfigParser
+import sys,os,argparse,socket,time,traceback
 from collections import OrderedDict as odict
 
-import requests
 from PyQt4 import QtGui,QtCore
 
-# Custom exception for catching communication errors with XBMC
-class XBMCException(Exception):
-  pass
-
-# Custom file descriptor for use with SafeConfigParser to insert a dummy section
-# (the library requires [Sections] in config file but I don't want any)
-class FakeSecHead(object):
-    def __init__(self, fp):
-        self.fp = fp
-        self.sechead = '[dummy]\n'
-    def readline(self):
-        if self.sechead:
-            try: 
-                return self.sechead
-            finally: 
-                self.sechead = None
-        else: 
-            return self.fp.readline()
+from xbmcrpc import (XBMCException,ControllerGroup,Coalescer,CommandQueue,
+    CONFIG,DEFAULTS,read_config,discover,parse_network,parse_ports,
+    local_network,get,sec2time,time2str,Library,library_path,art_path,ArtCache,
+    MACRO,macros)
 
 ################################################################################
 # Main window class                                                            #
@@ -32,48 +16,85 @@ class FakeSecHead(object):
 
 class Remote(QtGui.QMainWindow):
 
+  # XBMC notifications (method,data), re-emitted on the GUI thread
+  notification = QtCore.pyqtSignal(str,object)
+
   def __init__(self,args):
 
-    # default options
-    self.DEFAULTS = odict([ ('xbmc_ip','127.0.0.1'),
-                            ('xbmc_user',''),
-                            ('xbmc_pass',''),
-                            ('step_back',10),
-                            ('step_fore',10),
-                            ('def_plist',0) ])
+    # default options, set_keys() adds the keyboard shortcuts
+    self.DEFAULTS = odict(DEFAULTS)
 
     self.VALIDATORS = { 'xbmc_ip':ValidIP(),
+                        'timeout_conn':QtGui.QDoubleValidator(0.1,300,2),
+                        'timeout_read':QtGui.QDoubleValidator(0.1,300,2),
+                        'use_notify':QtGui.QIntValidator(0,1),
+                        'xbmc_tcp':QtGui.QIntValidator(1,65535),
+                        'transport':QtGui.QRegExpValidator(
+                            QtCore.QRegExp('get|post|tcp'),None),
+                        'pid_ttl':QtGui.QDoubleValidator(0,3600,1),
+                        'rel_cmds':QtGui.QIntValidator(0,1),
                         'step_back':QtGui.QIntValidator(1,86400),
                         'step_fore':QtGui.QIntValidator(1,86400),
-                        'def_plist':QtGui.QIntValidator(0,3) }
+                        'def_plist':QtGui.QIntValidator(0,3),
+                        'sync_secs':QtGui.QIntValidator(0,3600) }
+
+    # buttons of the main window by action id, created in initUI()
+    self.buttons = {}
 
-    # define keyboard shortcuts
+    # define the actions and their keyboard shortcuts
     self.set_keys()
 
     # number of columns for the buttons
     self.COLS = 3
 
+    # size of the thumbnail in the now playing panel
+    self.THUMB = 48
+
+    # a controller per host, created by load_config(); ctrl is the selected
+    # host's and target is its name, or None when all hosts are selected
+    self.group = None
+    self.ctrl = None
+    self.target = None
+
+    # the selected host's library index, once it has one
+    self.library = None
+
+    # dialogs that are kept once created and only shown again, by class
+    self.dialogs = {}
+
+    # the now playing panel polls when the next sync is due, unless one is
+    # already in flight; again means another was asked for in the meantime
+    self.np_item = None
+    self.np_text = 'Nothing playing'
+    self.np_art = ''
+    self.np_due = 0
+    self.np_busy = False
+    self.np_again = False
+
+    # worker threads so network calls never block the event loop
+    self.pool = QtCore.QThreadPool()
+    self.pool.setMaxThreadCount(4)
+    self.workers = set()
+
     super(Remote,self).__init__()
     self.parse_args(args)
     self.initUI()
     self.center()
     self.load_config()
-
-    # update dictionaries with values loaded from config
-    self.gen_key_dicts()
-    
     self.show()
 
   def parse_args(self,args):
     """parse command line arguments; you can specify a config file with -c"""
 
     parser = argparse.ArgumentParser()
-    d = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-    f = os.path.join(d,'remote.conf')
-    parser.add_argument('-c',default=f,help='path to config file',metavar='file')
+    parser.add_argument('-c',default=CONFIG,help='path to config file',
+        metavar='file')
     args = parser.parse_args()
     self.conf_file = args.c
 
+    # artwork shared by all hosts and windows, keyed by art URL
+    self.art = ArtCache(art_path(self.conf_file))
+
   def initUI(self):
     """create the main window UI including callbacks"""
 
@@ -81,10 +102,15 @@ class Remote(QtGui.QMainWindow):
     menu = self.menuBar().addMenu('&File')
     self.make_item(menu,'Info','Ctrl+I')
     self.make_item(menu,'Playlist','Ctrl+P')
+    self.make_item(menu,'Library','Ctrl+L')
     self.make_item(menu,'Remote','Ctrl+R')
     self.make_item(menu,'Keybindings','Ctrl+K')
+    self.make_item(menu,'Diagnostics','Ctrl+D')
     self.make_item(menu,'Options...','Ctrl+O')
 
+    # macros from the config get a menu of their own, filled by load_macros()
+    self.macro_menu = self.menuBar().addMenu('&Macros')
+
     # create the main grid where the buttons will be located
     grid = QtGui.QGridLayout()
     grid.setSpacing(10)
@@ -92,115 +118,131 @@ class Remote(QtGui.QMainWindow):
     area.setLayout(grid)
     self.setCentralWidget(area)
 
+    # the now playing panel sits above the buttons with the thumbnail to the
+    # left; the title may not widen the window, it is elided instead
+    panel = QtGui.QGridLayout()
+    self.np_thumb = QtGui.QLabel(self)
+    self.np_thumb.setFixedSize(self.THUMB,self.THUMB)
+    self.np_thumb.setAlignment(QtCore.Qt.AlignCenter)
+    panel.addWidget(self.np_thumb,0,0,2,1)
+    self.np_title = QtGui.QLabel('Nothing playing',self)
+    self.np_title.setAlignment(QtCore.Qt.AlignCenter)
+    self.np_title.setSizePolicy(QtGui.QSizePolicy.Ignored,
+        QtGui.QSizePolicy.Preferred)
+    panel.addWidget(self.np_title,0,1)
+    self.np_bar = QtGui.QProgressBar(self)
+    self.np_bar.setFormat('')
+    panel.addWidget(self.np_bar,1,1)
+    grid.addLayout(panel,0,0,2,self.COLS)
+
     # create the buttons as defined in set_keys()
-    self.buttons = {}
-    for (i,button) in enumerate(self.b_map.keys()):
-      row = i/self.COLS
+    aids = [aid for (aid,action) in self.actions.items() if action.button]
+    for (i,aid) in enumerate(aids):
+      row = i/self.COLS+2
       col = i%self.COLS
-      self.make_button(grid,button,row,col)
+      self.make_button(grid,aid,row,col)
 
     # create the statusbar and disabled resizing
     self.statusBar().setSizeGripEnabled(False)
 
+    # the host picker sits in the statusbar and is only shown for many hosts
+    self.host_box = QtGui.QComboBox(self)
+    self.host_box.setFocusPolicy(QtCore.Qt.NoFocus)
+    self.host_box.activated.connect(self.cb_host)
+    self.statusBar().addPermanentWidget(self.host_box)
+
+    # show whether the host is reachable, kept current from notifications
+    self.health_label = QtGui.QLabel('',self)
+    self.statusBar().addPermanentWidget(self.health_label)
+    self.notification.connect(self.cb_notify)
+
+    # redraw the now playing panel every second from the local clock
+    self.np_timer = QtCore.QTimer(self)
+    self.np_timer.timeout.connect(self.tick)
+    self.np_timer.start(1000)
+
     # disable resizing on the main window, set title, and set focus
     self.setFixedSize(self.sizeHint())
     self.setWindowTitle('XBMC Remote')
     self.setFocus()
 
   def set_keys(self):
-    """define keyboard shortcuts for the buttons"""
-    
-    # conf_names : config opts -> names
-    # conf_map : names -> config opts
-    # b_map : button names -> keys (initUI,makeButton)
-    # s_map : shortcut names -> keys
-    # b_keys : keys -> button names (keyPressEvent)
-    # s_keys : keys -> shortcut names (keyPressEvent)
-
-    # i manage two type of shortcuts, those tied to a button and those not
-    # shortcuts not tied to a button have a function as the third tuple value
-    opts = odict([('key_back',(QtCore.Qt.Key_Left,'Back')),
-                  ('key_paus',(QtCore.Qt.Key_Space,'Pause')),
-                  ('key_fore',(QtCore.Qt.Key_Right,'Fore')),
-                  ('key_prev',(QtCore.Qt.Key_PageUp,'Prev')),
-                  ('key_stop',(QtCore.Qt.Key_S,'Stop')),
-                  ('key_next',(QtCore.Qt.Key_PageDown,'Next')),
-                  ('key_vold',(QtCore.Qt.Key_Down,'Vol -')),
-                  ('key_mute',(QtCore.Qt.Key_M,'Mute')),
-                  ('key_volu',(QtCore.Qt.Key_Up,'Vol +')),
-                  ('key_quit',(QtCore.Qt.Key_Escape,'Quit',self.close))])
-    self.key_opts = opts
-    self.conf_names = {}
-    self.conf_map = {}
-    for (k,v) in opts.items():
-      self.DEFAULTS[k] = v[0]
-      self.conf_names[k] = v[1]
-      self.conf_map[v[1]] = k
-
-    # create dictionaries to defaults
-    self.gen_key_dicts()
-
-  def gen_key_dicts(self):
-    """generate dictionaries used at various points for key mapping"""
-
-    # check if self.opts has been created yet
-    opts = self.key_opts
-    if hasattr(self,'opts'):
-      for opt in opts:
-        val = list(opts[opt])
-        val[0] = int(self.opts[opt])
-        opts[opt] = tuple(val)
-    
-    # this must be an OrderedDict so buttons are populated in order in __init__
-    # most of these dictionaries are just for convenience in other functions
-    self.b_map = odict([(v[1],v[0]) for v in opts.values() if len(v)<3])
-    self.s_map = {v[1]:v[0] for v in opts.values() if len(v)>2}
-    self.b_keys = {v:k for (k,v) in self.b_map.items()}
-    self.s_keys = {v[0]:(v[1],v[2]) for v in opts.values() if len(v)>2}
-
-  def get_shortcut(self,name):
-    """return the shortcut for the given name"""
-
-    # check both b_map and s_map
-    if name in self.b_map:
-      return self.b_map[name]
-    if name in self.s_map:
-      return self.s_map[name]
-    return None
-
-  def update_key(self,name,key):
-    """update the key for the specified shortcut"""
-
-    # update self.opts
-    opt = self.conf_map[name]
-    self.opts[opt] = key
-
-    # check for a button shortcut and update related info
-    if name in self.b_map:
-      old = self.b_map[name]
-      del self.b_keys[old]
-      self.b_map[name] = key
-      self.b_keys[key] = name
-      self.buttons[name].setToolTip('Key: '+str(QtGui.QKeySequence(key).toString()))
-
-    # check for a non-button shortcut and update related info
-    if name in self.s_map:
-      old_key = self.s_map[name]
-      old_val = self.s_keys[old_key]
-      del self.s_keys[old_key]
-      self.s_map[name] = old_key
-      self.s_keys[key] = (name,old_val[1])
-
-  def make_button(self,grid,name,row,col):
+    """define the actions of the main window and their default keys"""
+
+    # actions by id; a key press is a single lookup in the key table made by
+    # map_keys(), and actions with a button get one in this order
+    Qt = QtCore.Qt
+    self.actions = odict([
+        ('back',Action('Back','key_back',Qt.Key_Left,self.hop,('back',))),
+        ('pause',Action('Pause','key_paus',Qt.Key_Space,self.act,('playpause',))),
+        ('fore',Action('Fore','key_fore',Qt.Key_Right,self.hop,('fore',))),
+        ('prev',Action('Prev','key_prev',Qt.Key_PageUp,self.act,('jump','prev'))),
+        ('stop',Action('Stop','key_stop',Qt.Key_S,self.act,('stop',))),
+        ('next',Action('Next','key_next',Qt.Key_PageDown,self.act,('jump','next'))),
+        ('vol-',Action('Vol -','key_vold',Qt.Key_Down,self.volume,('down',))),
+        ('mute',Action('Mute','key_mute',Qt.Key_M,self.act,('mute',))),
+        ('vol+',Action('Vol +','key_volu',Qt.Key_Up,self.volume,('up',))),
+        ('quit',Action('Quit','key_quit',Qt.Key_Escape,self.close,(),False))])
+    for action in self.actions.values():
+      self.DEFAULTS[action.opt] = action.key
+    self.map_keys()
+
+  def map_keys(self):
+    """take the key of every action from the config and build the key table"""
+
+    self.keys = {}
+    for (aid,action) in self.actions.items():
+      if hasattr(self,'opts'):
+        action.key = int(self.opts.get(action.opt,action.key))
+      if action.key:
+        self.keys[action.key] = action
+      self.show_key(aid)
+
+  def update_key(self,aid,key):
+    """bind the action aid to key"""
+
+    action = self.actions[aid]
+    self.opts[action.opt] = key
+    if self.keys.get(action.key) is action:
+      del self.keys[action.key]
+    action.key = key
+    self.keys[key] = action
+    self.show_key(aid)
+
+  def show_key(self,aid):
+    """show the key of the action aid in the tooltip of its button"""
+
+    if aid in self.buttons:
+      key = self.actions[aid].key
+      self.buttons[aid].setToolTip('Key: '+str(QtGui.QKeySequence(key).toString()))
+
+  def load_macros(self):
+    """make an action and a menu item of every macro in the config"""
+
+    # a macro's key stays unbound until it is set in the key bindings
+    for aid in [aid for aid in self.actions if aid.startswith(MACRO)]:
+      del self.actions[aid]
+    self.macro_menu.clear()
+    for (name,text) in macros(self.opts).items():
+      action = Action(name,'key_'+MACRO+name,0,self.act,('macro',text),False)
+      self.actions[MACRO+name] = action
+      self.opts.setdefault(action.opt,'0')
+      item = QtGui.QAction(name,self)
+      item.triggered.connect(lambda checked=False,a=action: self.trigger(a))
+      self.macro_menu.addAction(item)
+    self.macro_menu.menuAction().setVisible(not self.macro_menu.isEmpty())
+    self.map_keys()
+
+  def make_button(self,grid,aid,row,col):
     """helper function to create a button and add it to the grid"""
     
-    button = QtGui.QPushButton(name,self)
-    button.clicked.connect(self.cb_button)
+    action = self.actions[aid]
+    button = QtGui.QPushButton(action.name,self)
+    button.clicked.connect(lambda checked=False: self.trigger(action))
     button.resize(button.sizeHint())
-    key = self.b_map[name]
-    button.setToolTip('Key: '+str(QtGui.QKeySequence(key).toString()))
     grid.addWidget(button,row,col)
-    self.buttons[name] = button
+    self.buttons[aid] = button
+    self.show_key(aid)
 
   def make_item(self,menu,name,shortcut):
     """helper function to create a menu item and add it to the menu"""
@@ -226,23 +268,188 @@ class Remote(QtGui.QMainWindow):
     """read options from config file or set defaults"""
 
     # start with defaults, if the file does not exist write the defaults
-    self.opts = odict([(k,str(v)) for (k,v) in self.DEFAULTS.items()])
+    self.opts = read_config(self.conf_file,self.DEFAULTS)
     if not os.path.isfile(self.conf_file):
       self.save_config()
-      return
 
-    # read options from the config file into a dict
-    conf = SafeConfigParser()
-    result = conf.readfp(FakeSecHead(open(self.conf_file)))
-    opts = {x:y for (x,y) in conf.items('dummy')}
+    # update shortcuts and macros
+    self.load_macros()
+    self.make_conn()
+
+  def make_conn(self):
+    """(re)create a controller per host from the current options"""
+
+    if self.group is not None:
+      self.group.close()
+    self.group = ControllerGroup(self.opts)
+    for ctrl in self.group.ctrls.values():
+      ctrl.listeners.append(self.forward(ctrl))
+
+    # fill the host picker and keep the previous choice if it still exists
+    names = list(self.group.ctrls)
+    self.host_box.clear()
+    self.host_box.addItems(names+['All'])
+    self.host_box.setVisible(len(names)>1)
+    if self.target not in names:
+      self.target = names[0]
+    self.select_host(names.index(self.target))
+
+  def forward(self,ctrl):
+    """return a listener passing on notifications from ctrl while selected"""
+
+    def listener(method,data):
+      if ctrl is self.ctrl:
+        self.notification.emit(method,data)
+    return listener
+
+  def select_host(self,i):
+    """make the i-th host the target of actions and dialogs, or all of them"""
+
+    # dialogs show the first host while all of them are selected
+    names = list(self.group.ctrls)
+    self.target = names[i] if i<len(names) else None
+    self.ctrl = self.group.ctrls[self.target or names[0]]
+    self.coalescer = Coalescer(self.ctrl)
+    self.host_box.setCurrentIndex(i)
+
+    # keep the index of this host current if it has one
+    if self.library is not None:
+      self.library.close()
+    path = library_path(self.ctrl.opts['xbmc_ip'],self.conf_file)
+    self.library = Library(path) if os.path.isfile(path) else None
+
+    # forget what the previous host was playing and sync right away
+    self.np_due = 0
+    self.show_playing(None)
+
+    # find out if a host we have not talked to yet is there
+    self.show_health()
+    if self.ctrl.conn.health.connected is None:
+      self.run(self.ctrl.conn.ping)
+
+  def cb_notify(self,method,data):
+    """show the connection state and what is playing on the selected host"""
+
+    method = str(method)
+    if method in ('Connection.OnUp','Connection.OnDown'):
+      self.show_health()
+      self.statusBar().showMessage('%s %s' % (self.ctrl.conn.health,
+          self.ctrl.opts['xbmc_ip']))
+
+    # pause, seek and speed changes are already in the state model, only a
+    # new item needs a request
+    if method in ('Notifier.OnConnect','Connection.OnUp','Player.OnPlay',
+                  'Player.OnAVStart','Player.OnStop'):
+      self.sync_playing()
+
+    # keep the library index current, catching up after (re)connecting
+    if self.library is not None:
+      if method.split('.')[0] in ('AudioLibrary','VideoLibrary'):
+        self.run(self.library.apply,(self.ctrl.conn,method,data))
+      elif method=='Notifier.OnConnect':
+        self.run(self.library.sync,(self.ctrl.conn,))
+
+  def open_library(self):
+    """return the selected host's library index, creating it if need be"""
+
+    if self.library is None:
+      path = library_path(self.ctrl.opts['xbmc_ip'],self.conf_file)
+      self.library = Library(path)
+    return self.library
+
+  def tick(self):
+    """redraw the now playing panel, polling XBMC only when a sync is due"""
+
+    # without notifications the clock is only as good as the last poll
+    st = self.ctrl.state
+    if not st.synced and time.time()>=self.np_due:
+      self.sync_playing()
+
+    # the title is elided here since the label has no width until shown
+    metrics = self.np_title.fontMetrics()
+    self.np_title.setText(metrics.elidedText(self.np_text,QtCore.Qt.ElideRight,
+        self.np_title.width()))
+
+    # extrapolate the play time from the last sync
+    (t,total) = (st.elapsed(),st.total)
+    self.np_bar.setRange(0,max(1,total))
+    self.np_bar.setValue(t)
+    if total:
+      self.np_bar.setFormat('%s / %s' % (time2str(sec2time(t)),
+          time2str(sec2time(total))))
+    else:
+      self.np_bar.setFormat('')
 
-    # update self.opts with options from the config file
-    for opt in opts:
-      if opt in self.opts:
-        self.opts[opt] = opts[opt]
+  def sync_playing(self):
+    """fetch the title, and without notifications the times, of what is playing"""
 
-    # update shortcuts
-    self.gen_key_dicts()
+    if self.np_busy:
+      self.np_again = True
+      return
+    (self.np_busy,self.np_again) = (True,False)
+    secs = int(self.opts['sync_secs'])
+    self.np_due = time.time()+secs if secs else float('inf')
+
+    # drop the answer if the user switched hosts in the meantime
+    ctrl = self.ctrl
+    def done(item):
+      self.np_busy = False
+      if ctrl is self.ctrl:
+        self.show_playing(item)
+      if self.np_again:
+        self.sync_playing()
+    def failed(msg):
+      self.np_busy = False
+    self.run(ctrl.now_playing,(),done,failed)
+
+  def show_playing(self,item):
+    """show an item in the now playing panel, or that nothing is playing"""
+
+    self.np_item = item
+    self.np_text = get(item,'label','Unknown') if item else 'Nothing playing'
+    self.np_title.setToolTip(self.np_text)
+    self.tick()
+
+    # only a new thumbnail is fetched, and only the current one is shown
+    url = item.get('thumbnail','') if item else ''
+    if url==self.np_art:
+      return
+    self.np_art = url
+    self.np_thumb.clear()
+    def show(image):
+      if url==self.np_art:
+        self.np_thumb.setPixmap(QtGui.QPixmap.fromImage(image))
+    if url:
+      self.fetch_art(url,self.THUMB,show)
+
+  def fetch_art(self,url,size,callback):
+    """get and decode artwork on the worker pool; callback gets a QImage"""
+
+    # QImage, unlike QPixmap, may be made and scaled off the GUI thread;
+    # missing artwork is not worth a statusbar message
+    (art,conn) = (self.art,self.ctrl.conn)
+    def load():
+      image = QtGui.QImage.fromData(art.get(conn,url))
+      return image.scaled(size,size,QtCore.Qt.KeepAspectRatio,
+          QtCore.Qt.SmoothTransformation)
+    self.run(load,(),callback,lambda msg: None)
+
+  def show_health(self):
+    """show the selected host's connection state in the title and statusbar"""
+
+    health = self.ctrl.conn.health
+    self.health_label.setText(str(health))
+    title = 'XBMC Remote'
+    if health.connected is False:
+      title += ' (disconnected)'
+    self.setWindowTitle(title)
+
+  def cb_host(self,i):
+    """switch hosts and let open dialogs reload from the new one"""
+
+    self.select_host(i)
+    self.notification.emit('Notifier.OnConnect',{})
+    self.setFocus()
 
   def save_config(self):
     """save our current opts to the config file"""
@@ -260,194 +467,193 @@ class Remote(QtGui.QMainWindow):
   def keyPressEvent(self,e):
     """handle keyboard shortcuts"""
 
-    key = e.key()
-    if key in self.b_keys:
-      self.cb_button(self.b_keys[key])
-    if key in self.s_keys:
-      self.s_keys[key][1]()
+    action = self.keys.get(e.key())
+    if action is not None:
+      self.trigger(action)
 
   def cb_menu(self):
     """handle menu item presses"""
 
     t = self.sender().text()
     if t=='Info':
-      InfoDialog(self)
+      self.show_dialog(InfoDialog)
     elif t=='Playlist':
-      PlaylistDialog(self)
+      self.show_dialog(PlaylistDialog)
+    elif t=='Library':
+      self.show_dialog(LibraryDialog)
     elif t=='Remote':
-      RemoteDialog(self)
+      self.show_dialog(RemoteDialog)
     elif t=='Keybindings':
       KeybindDialog(self)
+    elif t=='Diagnostics':
+      self.show_dialog(DiagDialog)
     elif t=='Options...':
       OptsDialog(self)
 
-  def cb_button(self,b=None):
-    """handle button presses and set the statusbar message"""
+  def show_dialog(self,cls):
+    """show the dialog of class cls, created on first use and reused after"""
+
+    # a reused dialog paints what it showed last and refreshes in the
+    # background, so it opens without waiting for XBMC
+    dialog = self.dialogs.get(cls)
+    if dialog is None:
+      dialog = self.dialogs[cls] = cls(self)
+    elif dialog.isVisible():
+      dialog.raise_()
+    else:
+      dialog.reopen()
+      dialog.show()
+    dialog.activateWindow()
+
+  def trigger(self,action):
+    """run an action from its button, key or menu item"""
 
     # if we don't do this the button will get focus break and keyboard shortcuts
     self.setFocus()
+    action.func(*action.args)
 
-    # the param b is only set if called from keyPressEvent()
-    if not b:
-      b = self.sender().text()
+  def hop(self,d):
+    """hop back or forward by the step in the options"""
 
-    try:
-      if b=='Back':
-        msg = self.hop('back')
-      elif b=='Pause':
-        msg = self.playpause()
-      elif b=='Fore':
-        msg = self.hop('fore')
-      elif b=='Prev':
-        msg = self.jump('prev')
-      elif b=='Stop':
-        msg = self.stop()
-      elif b=='Next':
-        msg = self.jump('next')
-      elif b=='Vol -':
-        msg = self.volume('down')
-      elif b=='Mute':
-        msg = self.mute()
-      elif b=='Vol +':
-        msg = self.volume('up')
-      else:
-        return
+    x = int(self.opts['step_'+d])
+    self.step('seek',-x if d=='back' else x)
+
+  def volume(self,d):
+    """turn the volume down or up by 5%"""
+
+    self.step('volume',{'down':-5,'up':5}[d])
+
+  def step(self,kind,delta):
+    """seek or change the volume by delta"""
+
+    # presses are merged while a request is in flight, so holding a key sends
+    # one request with the net change
+    if self.target is not None:
+      if self.coalescer.press(kind,delta):
+        self.run(self.coalescer.flush,(kind,),self.show_status)
+      return
+    self.act({'seek':'seek','volume':'change_volume'}[kind],delta)
+
+  def act(self,method,*args):
+    """call a Controller method on the worker pool and show its message"""
+
+    # a new item changes the title, which only notifications would tell us
+    def done(msg):
+      self.show_status(msg)
+      if method in ('jump','stop','macro') and not self.ctrl.state.synced:
+        self.sync_playing()
+
+    # with all hosts selected every host gets it at once
+    if self.target is None:
+      self.run(self.group.broadcast,(method,args),done)
+    else:
+      self.run(getattr(self.ctrl,method),args,done)
+
+  def show_status(self,msg):
+    """set the statusbar message and refresh the cache counters in its tooltip"""
 
-    # catch xbmc communication errors to report them
-    except XBMCException as e:
-      msg = e.message
     self.statusBar().showMessage(msg)
+    self.statusBar().setToolTip('%s\n%s' % (self.ctrl.pids,self.art))
 
-  def playpause(self):
-    """play/pause"""
+  def run(self,func,args=(),callback=None,errback=None,progress=None):
+    """call func(*args) on the worker pool and hand the result to callback"""
 
-    # execute method
-    pid = self.xpid()
-    speed = self.xbmc('Player.PlayPause',{'playerid':pid})['speed']
+    # with progress func is a generator, progress gets lists of what it
+    # yields as they come and callback the count once it is exhausted
+    worker = (Worker if progress is None else StreamWorker)(func,args)
+    if progress is not None:
+      worker.signals.items.connect(progress)
+    if callback is not None:
+      worker.signals.done.connect(callback)
 
-    # get current time and total time for statusbar message
-    params = {'playerid':pid,'properties':['time','totaltime']}
-    result = self.xbmc('Player.GetProperties',params)
-    current = result['time']
-    total = result['totaltime']
+    # errors go to the statusbar unless the caller wants them
+    worker.signals.failed.connect(errback or self.show_status)
 
-    # return statusbar message
-    if speed==0:
-      return 'Paused at %s / %s' % (time2str(current),time2str(total))
-    left = time2sec(total)-time2sec(current)
-    return 'Playing with %s / %s left' % (time2str(sec2time(left)),time2str(total))
+    # keep a reference until the worker is done so it is not collected
+    self.workers.add(worker)
+    worker.signals.finished.connect(lambda: self.workers.discard(worker))
+    self.pool.start(worker)
 
-  def hop(self,d):
-    """hop slightly forward or backward in the video"""
+################################################################################
+# Action class                                                                 #
+################################################################################
 
-    # get current time and total time
-    x = int(self.opts['step_'+d])
-    if d=='back':
-      x = -x
-    pid = self.xpid()
-    params = {'playerid':pid,'properties':['time','totaltime']}
-    result = self.xbmc('Player.GetProperties',params)
-
-    # limit t to [0,totaltime]
-    t = time2sec(result['time'])
-    total = time2sec(result['totaltime'])
-    t = min(total,max(0,t+x))
-    t = sec2time(t)
-
-    # execute method and return statusbar message
-    self.xbmc('Player.Seek',{'playerid':pid,'value':t})
-    return 'Seek to '+time2str(t)
-
-  def stop(self):
-    """stop playing"""
-    
-    pid = self.xpid()
-    result = self.xbmc('Player.Stop',{'playerid':pid})
-    return 'Stopped'
-
-  def jump(self,d):
-
-    # check playlist size
-    pid = self.xpid()
-    params = {'playlistid':pid,'properties':['size']}
-    siz = self.xbmc('Playlist.GetProperties',params)['size']
-
-    # execute method
-    if d=='prev':
-      params = {'playerid':pid,'to':'previous'}
-      self.xbmc('Player.GoTo',params)
-      if siz==0:
-        return 'Jumped to beginning'
-    if d=='next':
-      if siz==0:
-        return 'No playlist'
-      params = {'playerid':pid,'to':'next'}
-      self.xbmc('Player.GoTo',params)
-
-    # return statusbar message
-    params = {'playerid':pid,'properties':['position']}
-    pos = self.xbmc('Player.GetProperties',params)['position']+1
-    return 'Jumped to: %i / %i' % (pos,siz)
-
-  def mute(self):
-    """mute/unmute"""
-    
-    result = self.xbmc('Application.SetMute',{'mute':'toggle'})
-    return {True:'Muted',False:'Unmuted'}[result]
+class Action(object):
 
-  def volume(self,d):
-    """adjust volume"""
+  def __init__(self,name,opt,key,func,args=(),button=True):
+    """something the main window does: func(*args) under a name shown on its
+    button and in the key bindings, with its key stored in the option opt"""
 
-    # get current volume
-    d = {'down':-5,'up':5}[d]
-    pid = self.xpid()
-    params = {'properties':['volume']}
-    result = self.xbmc('Application.GetProperties',params)
-    vol = result['volume']
+    self.name = name
+    self.opt = opt
+    self.key = key
+    self.func = func
+    self.args = args
+    self.button = button
 
-    # limit vol to [0,100] and execute method
-    vol = min(100,max(0,vol+d))
-    self.xbmc('Application.SetVolume',{'volume':vol})
-    return 'Volume: '+str(vol)+'%'
+################################################################################
+# Worker thread classes                                                        #
+################################################################################
 
-  def xbmc(self,method,params=None):
-    """make a request to the XBMC JSON-RPC web interface"""
-
-    # build request
-    p = {'jsonrpc':'2.0','id':1,'method':method}
-    if params is not None:
-      p['params'] = params
-    url = 'http://'+self.opts['xbmc_ip']+'/jsonrpc'
-    headers = {'content-type':'application/json'}
-    payload = p
-    params = {'request':json.dumps(payload)}
-    usr = self.opts['xbmc_user']
-    pw = self.opts['xbmc_pass']
-
-    # catch ConnectionError exceptions from requests library
+class WorkerSignals(QtCore.QObject):
+
+  done = QtCore.pyqtSignal(object)
+  items = QtCore.pyqtSignal(object)
+  failed = QtCore.pyqtSignal(str)
+  finished = QtCore.pyqtSignal()
+
+class Worker(QtCore.QRunnable):
+
+  def __init__(self,func,args):
+    """wrap func(*args) so it can run on a QThreadPool"""
+
+    super(Worker,self).__init__()
+    self.setAutoDelete(False)
+    self.func = func
+    self.args = args
+    self.signals = WorkerSignals()
+
+  def run(self):
+    """call the function and emit its result or error message"""
+
+    # catch xbmc communication errors to report them
     try:
-      r = requests.get(url,params=params,headers=headers,auth=(usr,pw))
+      self.signals.done.emit(self.func(*self.args))
+    except XBMCException as e:
+      self.signals.failed.emit(e.message)
     except Exception as e:
-      raise XBMCException(e.__class__.__name__)
+      traceback.print_exc()
+      self.signals.failed.emit(e.__class__.__name__)
+    finally:
+      self.signals.finished.emit()
 
-    # catch HTTP error responses (e.g. 401 Forbidden)
-    if not r.ok:
-      raise XBMCException('HTTP %i - %s' % (r.status_code,r.reason))
+class StreamWorker(Worker):
 
-    # raise the JSON error message, or return the contents of the 'result' field
-    r = json.loads(r.text)
-    if 'error' in r:
-      raise XBMCException(r['error']['message'])
-    return r['result']
-    
-  def xpid(self):
-    """helper method to get the id of the currently active player"""
+  # seconds to collect items for before handing them to the GUI thread
+  INTERVAL = 0.05
 
-    # returns any of [None,0,1,2]
-    j = self.xbmc('Player.GetActivePlayers')
-    if len(j)==0:
-      return None
-    return j[0]['playerid']
+  def run(self):
+    """iterate the generator and emit what it yields in batches"""
+
+    # one signal per item would flood the event loop, one per batch still
+    # shows the first items long before the last arrive
+    try:
+      (batch,count,last) = ([],0,time.time())
+      for x in self.func(*self.args):
+        batch.append(x)
+        if time.time()-last>=self.INTERVAL:
+          self.signals.items.emit(batch)
+          (batch,count,last) = ([],count+len(batch),time.time())
+      if batch:
+        self.signals.items.emit(batch)
+      self.signals.done.emit(count+len(batch))
+    except XBMCException as e:
+      self.signals.failed.emit(e.message)
+    except Exception as e:
+      traceback.print_exc()
+      self.signals.failed.emit(e.__class__.__name__)
+    finally:
+      self.signals.finished.emit()
 
 ################################################################################
 # Validators                                                                   #
@@ -497,11 +703,26 @@ class RemoteDialog(QtGui.QDialog):
   def __init__(self,parent):
 
     super(RemoteDialog,self).__init__(parent)
+
+    # commands go out in order through a queue; typed characters are buffered
+    # and sent as one Input.SendText after a short pause
+    self.queue = CommandQueue(parent.ctrl)
+    self.text = ''
+    self.timer = QtCore.QTimer(self)
+    self.timer.setSingleShot(True)
+    self.timer.setInterval(300)
+    self.timer.timeout.connect(self.send_text)
+
     self.initUI()
     self.set_keys()
     self.show()
     self.setFocus()
 
+  def reopen(self):
+    """take the focus again when shown"""
+
+    self.setFocus()
+
   def set_keys(self):
     """create shortcuts"""
 
@@ -542,21 +763,20 @@ class RemoteDialog(QtGui.QDialog):
     """handle button presses"""
 
     b = self.sender().text()
-    xbmc = self.parent().xbmc
     if b=='Context':
-      xbmc('Input.ContextMenu')
+      self.xbmc('Input.ContextMenu')
     elif b=='Fullscreen':
-      xbmc('GUI.SetFullscreen',{'fullscreen':'toggle'})
+      self.xbmc('GUI.SetFullscreen',{'fullscreen':'toggle'})
     elif b=='OSD':
-      xbmc('Input.ExecuteAction',{'action':'osd'})
+      self.xbmc('Input.ExecuteAction',{'action':'osd'})
     self.setFocus()
 
   def keyPressEvent(self,e):
     """handle keyboard shortcuts"""
 
     key = e.key()
-    xbmc = self.parent().xbmc
-    
+    xbmc = self.xbmc
+
     if key in self.keys:
       action = self.keys[key]
       if isinstance(action,tuple):
@@ -569,7 +789,33 @@ class RemoteDialog(QtGui.QDialog):
       except:
         return
       if len(s)==1 and ord(s)>31 and ord(s)<127:
-        xbmc('Input.SendText',{'text':s,'done':False})
+        self.text += s
+        self.timer.start()
+
+  def send_text(self):
+    """send the buffered characters"""
+
+    self.timer.stop()
+    if self.text:
+      (text,self.text) = (self.text,'')
+      self.queue_call('Input.SendText',{'text':text,'done':False})
+
+  def xbmc(self,method,params=None):
+    """send a request after any buffered text without waiting for the result"""
+
+    self.send_text()
+    self.queue_call(method,params)
+
+  def queue_call(self,method,params):
+    """queue a request and start draining the queue if it is idle"""
+
+    # follow the host selected in the main window, which may also have been
+    # replaced by saving the options
+    p = self.parent()
+    if self.queue.ctrl is not p.ctrl:
+      self.queue = CommandQueue(p.ctrl)
+    if self.queue.put(method,params):
+      p.run(self.queue.drain)
 
 ################################################################################
 # Options dialog class                                                         #
@@ -595,12 +841,17 @@ class OptsDialog(QtGui.QDialog):
     # add QLabels and QLineEdits
     p = self.parent()
     opts = [x for x in p.opts.keys() if not x.startswith('key')]
+    self.boxes = {}
     for (row,opt) in enumerate(opts):
       grid.addWidget(QtGui.QLabel(opt,self),row,0)
       box = QtGui.QLineEdit(p.opts[opt],self)
       if opt in p.VALIDATORS:
         box.setValidator(p.VALIDATORS[opt])
       grid.addWidget(box,row,1)
+      self.boxes[opt] = box
+
+    # the scan button goes next to the address it fills in
+    self.make_button(grid,'Scan...',opts.index('xbmc_ip'),2)
 
     # add OK and Cancel buttons
     row += 1
@@ -624,6 +875,9 @@ class OptsDialog(QtGui.QDialog):
 
     # only save config on 'OK' but close the dialog either way
     b = self.sender().text()
+    if b=='Scan...':
+      ScanDialog(self)
+      return
     if b=='OK':
       self.save_config()
     self.close()
@@ -641,6 +895,145 @@ class OptsDialog(QtGui.QDialog):
       val = grid.itemAtPosition(i,1).widget().text()
       p.opts[str(opt)] = str(val)
     p.save_config()
+    p.load_macros()
+    p.make_conn()
+
+################################################################################
+# Scan dialog class                                                            #
+################################################################################
+
+class ScanDialog(QtGui.QDialog):
+
+  # probe results, emitted from the worker pool
+  found = QtCore.pyqtSignal(str,str)
+  progress = QtCore.pyqtSignal(int)
+
+  def __init__(self,parent):
+
+    super(ScanDialog,self).__init__(parent)
+    self.initUI()
+    self.setModal(True)
+    self.show()
+
+  def initUI(self):
+    """create the network and port boxes, result list and buttons"""
+
+    # create a grid layout
+    grid = QtGui.QGridLayout()
+    grid.setSpacing(10)
+    self.setLayout(grid)
+
+    # where to look, defaulting to our own /24 and the XBMC web server port
+    port = self.parent().boxes['xbmc_ip'].text().split(':')[1:] or ['8080']
+    grid.addWidget(QtGui.QLabel('Network:',self),0,0)
+    self.network = QtGui.QLineEdit(local_network(),self)
+    grid.addWidget(self.network,0,1)
+    grid.addWidget(QtGui.QLabel('Ports:',self),0,2)
+    self.ports = QtGui.QLineEdit(port[0],self)
+    grid.addWidget(self.ports,0,3)
+    self.make_button(grid,'Scan',0,4)
+
+    # hosts are listed as they are found
+    self.lis = QtGui.QListWidget(self)
+    self.targets = []
+    grid.addWidget(self.lis,1,0,1,5)
+    self.status = QtGui.QLabel('',self)
+    grid.addWidget(self.status,2,0,1,3)
+    self.make_button(grid,'Use',2,3)
+    self.make_button(grid,'Add',2,4)
+
+    self.found.connect(self.add_host)
+    self.progress.connect(self.show_progress)
+    (self.scanning,self.cancelled,self.total) = (False,False,0)
+    self.setWindowTitle('Scan for XBMC')
+
+  def make_button(self,grid,name,row,col):
+    """helper function to create a button and add it to the grid"""
+
+    button = QtGui.QPushButton(name,self)
+    button.clicked.connect(self.cb_button)
+    button.resize(button.sizeHint())
+    grid.addWidget(button,row,col)
+
+  def cb_button(self):
+    """start a scan or copy the selected host into the options"""
+
+    b = self.sender().text()
+    if b=='Scan':
+      self.start()
+      return
+
+    # 'Use' replaces xbmc_ip and 'Add' appends to the hosts list
+    row = self.lis.currentRow()
+    if row<0:
+      return
+    target = self.targets[row]
+    boxes = self.parent().boxes
+    if b=='Use':
+      boxes['xbmc_ip'].setText(target)
+    elif b=='Add':
+      hosts = [x for x in str(boxes['hosts'].text()).split(',') if x.strip()]
+      boxes['hosts'].setText(', '.join(hosts+[target]))
+
+  def start(self):
+    """check the input and probe it on the worker pool"""
+
+    if self.scanning:
+      return
+    (network,ports) = (str(self.network.text()),str(self.ports.text()))
+    try:
+      self.total = len(parse_network(network))*len(parse_ports(ports))
+    except ValueError as e:
+      self.status.setText(str(e))
+      return
+
+    self.lis.clear()
+    self.targets = []
+    self.scanning = True
+    self.show_progress(0)
+    r = self.parent().parent()
+    r.run(self.scan,(network,ports,r.opts['xbmc_user'],r.opts['xbmc_pass']),
+        self.scan_done,self.scan_done)
+
+  def scan(self,network,ports,user,pw):
+    """probe every address, reporting through signals; runs on the worker pool"""
+
+    n = 0
+    for (target,status) in discover(network,ports,user,pw):
+      if self.cancelled:
+        break
+      n += 1
+      if n%16==0 or n==self.total:
+        self.progress.emit(n)
+      if status is not None:
+        self.found.emit(target,status)
+    return 'Scanned %i addresses' % n
+
+  def add_host(self,target,status):
+    """list a host that answered"""
+
+    text = target if status=='OK' else '%s (%s)' % (target,status)
+    self.lis.addItem(text)
+    self.targets.append(str(target))
+    if self.lis.count()==1:
+      self.lis.setCurrentRow(0)
+
+  def show_progress(self,n):
+    """show how far the scan is"""
+
+    self.status.setText('Scanning... %i / %i' % (n,self.total))
+
+  def scan_done(self,msg):
+    """show how the scan ended"""
+
+    self.scanning = False
+    self.status.setText('%s, found %i' % (msg,self.lis.count()))
+
+  def closeEvent(self,event):
+    """stop a running scan once closed"""
+
+    self.cancelled = True
+    super(ScanDialog,self).closeEvent(event)
 
 ################################################################################
 # Keybind dialog class                                                         #
@@ -666,16 +1059,16 @@ class KeybindDialog(QtGui.QDialog):
     lis = QtGui.QListWidget(self)
     self.lis = lis
     grid.addWidget(lis,0,0,1,2)
+    self.aids = []
     self.names = []
     self.key_names = []
     p = self.parent()
-    for (opt,name) in p.conf_names.items():
-      if opt.startswith('key'):
-        key = p.get_shortcut(name)
-        key_name = str(QtGui.QKeySequence(key).toString())
-        self.names.append(name)
-        self.key_names.append(key_name)
-        lis.addItem('%s = %s' % (name,key_name))
+    for (aid,action) in p.actions.items():
+      key_name = str(QtGui.QKeySequence(action.key).toString())
+      self.aids.append(aid)
+      self.names.append(action.name)
+      self.key_names.append(key_name)
+      lis.addItem('%s = %s' % (action.name,key_name))
 
     # create the buttons
     self.make_button(grid,'Edit',1,0)
@@ -717,7 +1110,7 @@ class KeybindDialog(QtGui.QDialog):
     self.lis.item(i).setText(text)
 
     # send the update to our parent
-    self.parent().update_key(name,code)
+    self.parent().update_key(self.aids[i],code)
 
 ################################################################################
 # Keypress dialog class                                                        #
@@ -833,10 +1226,19 @@ class KeypressDialog(QtGui.QDialog):
 ################################################################################
 
 class InfoDialog(QtGui.QDialog):
+
+  # largest side of the artwork
+  ART = 160
+
+  # the fields get_info() returns while something is playing
+  FIELDS = ['Title','Artist','Album','Player ID','Media','Speed',
+            'Current Time','Total Time','Playlist']
   
   def __init__(self,parent):
     
     super(InfoDialog,self).__init__(parent)
+    self.info = None
+    self.art_url = None
     self.initUI()
     self.show()
 
@@ -848,62 +1250,277 @@ class InfoDialog(QtGui.QDialog):
     grid.setSpacing(5)
     self.setLayout(grid)
 
-    # for every entry returned by get_info() create a label and a textbox
-    for (row,(k,v)) in enumerate(self.get_info().items()):
-      grid.addWidget(QtGui.QLabel(k+':',self),row,0)
-      label = QtGui.QLineEdit(v,self)
-      label.setReadOnly(True)
-      label.setCursorPosition(0)
-      label.setMinimumWidth(300)
-      grid.addWidget(label,row,1)
+    # the artwork of the playing item goes right of the info, from the cache
+    # if it was shown before
+    self.art = QtGui.QLabel(self)
+    self.art.setAlignment(QtCore.Qt.AlignTop|QtCore.Qt.AlignHCenter)
+    self.art.hide()
 
-    # disable resizing and name the window
-    self.setFixedSize(self.sizeHint())
+    self.rows = []
     self.setWindowTitle('Media Info')
+    self.reopen()
 
-  def get_info(self):
-    """return relevant info about the currently playing item in XBMC"""
-
-    # we will return an OrderedDict to keep them in order
-    info = odict()
-    xbmc = self.parent().xbmc
-
-    # check if anything is playing
-    pid = self.parent().xpid()
-    if pid is None:
-      return {'Info':'Nothing playing.'}
-
-    # get artist and album
-    params = {'playerid':pid,'properties':['artist','album']}
-    result = xbmc('Player.GetItem',params)['item']
-    info['Title'] = get(result,'label','Unknown')
-    artist = result.get('artist',['Unknown'])
-    if len(artist)==0 or artist[0].strip()=='':
-      artist = ['Unknown']
-    info['Artist'] = artist[0]
-    info['Album'] = get(result,'album','Unknown')
-
-    # get playerid and media type
-    result = xbmc('Player.GetActivePlayers')
-    info['Player ID'] = str(result[0]['playerid'])
-    info['Media'] = result[0]['type'].title()
-
-    # get speed, time, and totaltime
-    params = {'playerid':pid,'properties':['speed','time','totaltime']}
-    result = xbmc('Player.GetProperties',params)
-    info['Speed'] = {0:'Paused',1:'Playing'}[result['speed']]
-    info['Current Time'] = time2str(result['time'])
-    info['Total Time'] = time2str(result['totaltime'])
-
-    # get current position in playlist
-    params = {'playerid':pid,'properties':['position']}
-    pos = xbmc('Player.GetProperties',params)['position']+1
-    params = {'playlistid':pid,'properties':['size']}
-    siz = xbmc('Playlist.GetProperties',params)['size']
-    info['Playlist'] = '%i / %i' % (pos,siz)
+  def reopen(self):
+    """show what is known at once and fetch the rest on the worker pool"""
 
+    p = self.parent()
+    self.fill(self.known())
+    p.run(p.ctrl.get_info,(),self.got,lambda msg:self.fill({'Info':msg}))
+
+    # the artwork URL comes with the now playing panel, often from the cache
+    if p.np_art!=self.art_url:
+      self.art_url = p.np_art
+      self.art.clear()
+      self.art.hide()
+      if p.np_art:
+        p.fetch_art(p.np_art,self.ART,self.show_art)
+
+  def known(self):
+    """the info as last fetched, with the title and times brought up to date"""
+
+    # the title comes from the now playing panel and the times from the
+    # local clock; what is still missing shows as '...'
+    p = self.parent()
+    st = p.ctrl.state
+    info = self.info
+    if info is None or (p.np_item and 'Title' not in info):
+      info = [(k,'...') for k in self.FIELDS]
+    info = odict(info)
+    if p.np_item and 'Title' in info:
+      info['Title'] = p.np_text
+    if 'Current Time' in info and st.total:
+      info['Current Time'] = time2str(sec2time(st.elapsed()))
+      info['Total Time'] = time2str(sec2time(st.total))
     return info
 
+  def got(self,info):
+    """remember and show info from get_info()"""
+
+    self.info = info
+    self.fill(info)
+
+  def fill(self,info):
+    """show the given info, in the same boxes if the fields are the same"""
+
+    # only update the text if the rows are there already
+    grid = self.layout()
+    if [str(w.text()).rstrip(':') for w in self.rows[::2]]==list(info):
+      for (box,v) in zip(self.rows[1::2],info.values()):
+        box.setText(v)
+        box.setCursorPosition(0)
+      return
+
+    # remove the old rows
+    for w in self.rows:
+      grid.removeWidget(w)
+      w.deleteLater()
+    self.rows = []
+
+    # for every entry in info create a label and a textbox
+    for (row,(k,v)) in enumerate(info.items()):
+      label = QtGui.QLabel(k+':',self)
+      grid.addWidget(label,row,0)
+      box = QtGui.QLineEdit(v,self)
+      box.setReadOnly(True)
+      box.setCursorPosition(0)
+      box.setMinimumWidth(300)
+      grid.addWidget(box,row,1)
+      self.rows.extend([label,box])
+    self.resize_to_fit()
+
+  def show_art(self,image):
+    """show the artwork next to the info"""
+
+    self.art.setPixmap(QtGui.QPixmap.fromImage(image))
+    self.art.show()
+    self.resize_to_fit()
+
+  def resize_to_fit(self):
+    """place the artwork beside all rows and disable resizing"""
+
+    grid = self.layout()
+    if not self.art.isHidden():
+      grid.addWidget(self.art,0,2,max(1,len(self.rows)/2),1)
+    grid.activate()
+    self.setFixedSize(self.sizeHint())
+
+################################################################################
+# Playlist model class                                                         #
+################################################################################
+
+class PlaylistModel(QtCore.QAbstractListModel):
+
+  # items per Playlist.GetItems request and the number of pages kept in memory;
+  # rows show as the items stream in, so a large page does not delay the first
+  PAGE = 500
+  PAGES = 20
+
+  def __init__(self,parent):
+    """list model that fetches and keeps playlist pages as rows are shown"""
+
+    super(PlaylistModel,self).__init__(parent)
+    self.remote = parent.parent()
+    self.mode = 'Full Path'
+    self.size = 0
+    self.plid = None
+    self.pages = odict()
+    self.pending = set()
+    self.generation = 0
+
+  def reset(self,plid,size):
+    """start over with a new playlist id and size, dropping all pages"""
+
+    self.beginResetModel()
+    (self.plid,self.size) = (plid,size)
+    self.pages.clear()
+    self.pending.clear()
+    self.generation += 1
+    self.endResetModel()
+
+  def insert(self,pos):
+    """add a row for an item inserted at pos; return False on a gap"""
+
+    if pos>self.size:
+      return False
+    self.beginInsertRows(QtCore.QModelIndex(),pos,pos)
+    self.size += 1
+    self.drop_from(pos)
+    self.endInsertRows()
+    return True
+
+  def remove(self,pos):
+    """drop the row of an item removed at pos; return False if there is none"""
+
+    if pos>=self.size:
+      return False
+    self.beginRemoveRows(QtCore.QModelIndex(),pos,pos)
+    self.size -= 1
+    self.drop_from(pos)
+    self.endRemoveRows()
+    return True
+
+  def drop_from(self,pos):
+    """forget the pages from the one holding pos onwards since their rows moved"""
+
+    first = pos/self.PAGE
+    for page in [x for x in self.pages if x>=first]:
+      del self.pages[page]
+
+    # pages in flight may have been read before the change, so they go too
+    # and are fetched again when shown
+    for page in self.pending:
+      self.pages.pop(page,None)
+    self.pending.clear()
+    self.generation += 1
+
+  def set_mode(self,mode):
+    """change the display mode; only rows in view are rendered again"""
+
+    self.mode = mode
+    if self.size:
+      self.dataChanged.emit(self.index(0),self.index(self.size-1))
+
+  def rowCount(self,parent=QtCore.QModelIndex()):
+    """number of items in the playlist, whether fetched or not"""
+
+    if parent.isValid():
+      return 0
+    return self.size
+
+  def data(self,index,role=QtCore.Qt.DisplayRole):
+    """return the text for a row, fetching its page if we don't have it"""
+
+    if role!=QtCore.Qt.DisplayRole or not index.isValid():
+      return None
+    row = index.row()
+    (page,i) = (row/self.PAGE,row%self.PAGE)
+    prefix = str(row+1).zfill(len(str(self.size)))+'   |   '
+
+    # move the page to the end so the least recently shown is evicted first
+    if page in self.pages:
+      cached = self.pages.pop(page)
+      self.pages[page] = cached
+
+      # format each item once per display mode, also while it streams in
+      lines = cached['lines'].setdefault(self.mode,[])
+      items = cached['items']
+      lines.extend([self.format(x) for x in items[len(lines):]])
+      if i<len(lines):
+        return prefix+lines[i]
+      return prefix+('...' if page in self.pending else '')
+    self.fetch(page)
+    return prefix+'...'
+
+  def format(self,item):
+    """format an item based on the display mode"""
+
+    if self.mode=='Full Path':
+      return get(item,'file','unknown.xyz')
+    if self.mode=='Filename':
+      return get(item,'label','unknown.xyz')
+    if self.mode=='Title':
+      return get(item,'title','Unknown')
+    if self.mode=='Album - Title':
+      return get(item,'album','Unknown')+' - '+get(item,'title','Unknown')
+
+  def fetch(self,page):
+    """stream a page of items in on the worker pool"""
+
+    if page in self.pending:
+      return
+    self.pending.add(page)
+    self.pages[page] = {'items':[],'lines':{}}
+    self.evict()
+    start = page*self.PAGE
+    end = min(self.size,start+self.PAGE)
+    gen = self.generation
+    self.remote.run(self.remote.ctrl.iter_items,(self.plid,start,end),
+        lambda count:self.end_page(gen,page),
+        lambda msg:self.fail_page(gen,page,msg),
+        progress=lambda items:self.add_rows(gen,page,items))
+
+  def add_rows(self,gen,page,items):
+    """append items that arrived for a page and redraw their rows"""
+
+    # ignore pages from before the last reset
+    if gen!=self.generation or page not in self.pages:
+      return
+    cached = self.pages[page]['items']
+    start = page*self.PAGE+len(cached)
+    cached.extend(items)
+    end = min(self.size,start+len(items))-1
+    if end>=start:
+      self.dataChanged.emit(self.index(start),self.index(end))
+
+  def end_page(self,gen,page):
+    """mark a page as complete and redraw rows it came up short of"""
+
+    if gen!=self.generation:
+      return
+    self.pending.discard(page)
+    start = page*self.PAGE
+    end = min(self.size,start+self.PAGE)-1
+    if end>=start:
+      self.dataChanged.emit(self.index(start),self.index(end))
+
+  def fail_page(self,gen,page,msg):
+    """forget a page that could not be fetched and show why"""
+
+    # its rows are not redrawn, which would retry at once; the page is
+    # fetched again when they are next shown
+    self.remote.show_status(msg)
+    if gen!=self.generation:
+      return
+    self.pending.discard(page)
+    self.pages.pop(page,None)
+
+  def evict(self):
+    """drop the least recently shown complete pages beyond PAGES"""
+
+    done = [x for x in self.pages if x not in self.pending]
+    for page in done[:max(0,len(self.pages)-self.PAGES)]:
+      del self.pages[page]
+
 ################################################################################
 # Playlist info dialog class                                                   #
 ################################################################################
@@ -917,7 +1534,7 @@ class PlaylistDialog(QtGui.QDialog):
     self.show()
 
   def initUI(self):
-    """create labels, drop-down menu, and main textbox"""
+    """create labels, drop-down menu, and playlist view"""
 
     default = int(self.parent().opts['def_plist'])
 
@@ -927,11 +1544,8 @@ class PlaylistDialog(QtGui.QDialog):
     self.setLayout(grid)
 
     # add a label for current playlist position and shuffled flag
-    info = self.get_info()
-    text = 'Current item: %s / %i' % (info['current'],len(info['items']))
-    if info['shuffled']:
-      text += ' (Shuffled)'
-    grid.addWidget(QtGui.QLabel(text,self),0,0)
+    self.label = QtGui.QLabel('Loading...',self)
+    grid.addWidget(self.label,0,0)
 
     # add a label describing the dropdown
     label = QtGui.QLabel('Display: ',self)
@@ -946,108 +1560,356 @@ class PlaylistDialog(QtGui.QDialog):
     box.currentIndexChanged.connect(self.cb_box)
     grid.addWidget(box,0,2)
 
-    # add the main text box and disable editing
-    items = QtGui.QTextEdit(self)
-    items.setMinimumSize(500,300)
-    items.setReadOnly(True)
-    grid.addWidget(items,1,0,1,3)
-
-    # populate the textbox
-    self.cb_box(default)
+    # add a button to drop the cached playlist and fetch it again
+    button = QtGui.QPushButton('Refresh',self)
+    button.clicked.connect(self.refresh)
+    grid.addWidget(button,0,3)
+
+    # add the list view; with uniform row heights it only asks the model for
+    # the rows that are visible, so only those pages are ever fetched
+    self.model = PlaylistModel(self)
+    view = QtGui.QListView(self)
+    view.setModel(self.model)
+    view.setUniformItemSizes(True)
+    view.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+    view.setMinimumSize(500,300)
+    grid.addWidget(view,1,0,1,4)
+
+    # populate the list and follow changes to the playlist
+    self.model.mode = self.disp_opts[default]
+    (self.current,self.shuffled) = (0,False)
+    self.stale = False
+    self.refresh()
+    self.parent().notification.connect(self.cb_notify)
 
     # set window title
     self.setWindowTitle('Playlist')
 
-  def get_info(self):
-    """return playlist and shuffled info"""
-
-    # return empty values if nothing is playing or there is no playlist
-    xbmc = self.parent().xbmc
-    pid = self.parent().xpid()
-    if pid is None:
-      return {'current':0,'items':[],'shuffled':False}
-    params = {'playlistid':pid,'properties':['size']}
-    siz = xbmc('Playlist.GetProperties',params)['size']
-    if siz==0:
-      return {'current':0,'items':[],'shuffled':False}
-
-    # get playlist items
-    params = {'playerid':pid,'properties':['position']}
-    pos = xbmc('Player.GetProperties',params)['position']+1
-    params = {'playlistid':pid,'properties':['title','file','album']}
-    items = xbmc('Playlist.GetItems',params)['items']
-
-    # get shuffled state
-    params = {'playerid':pid,'properties':['shuffled']}
-    shuf = xbmc('Player.GetProperties',params)['shuffled']
-    
-    return {'current':pos,'items':items,'shuffled':shuf}
+  def reopen(self):
+    """keep the cached rows unless the playlist changed while we were hidden"""
+
+    (force,self.stale) = (self.stale,False)
+    self.refresh(force)
 
   def cb_box(self,i):
-    """update textbox when the dropdown menu choice is changed"""
-
-    # get dropdown choice and playlist items
-    box = self.sender()
-    items = self.get_info()['items']
-    choice = self.disp_opts[i]
-    lines = []
-
-    # iterate over every playlist item and add info based on the dropdown choice
-    for (i,item) in enumerate(items):
-      s = str(i+1).zfill(int(math.log(len(items),10))+1)+'&nbsp;'*3+'|'+'&nbsp;'*3
-      if choice=='Full Path':
-        s += get(item,'file','unknown.xyz')
-      if choice=='Filename':
-        s += get(item,'label','unknown.xyz')
-      if choice=='Title':
-        s += get(item,'title','Unknown')
-      if choice=='Album - Title':
-        s += (get(item,'album','Unknown')+' - '+get(item,'title','Unknown'))
-      lines.append(s)
-
-    # update textbox
-    self.layout().itemAtPosition(1,0).widget().setHtml('<br>'.join(lines))
+    """update the list when the dropdown menu choice is changed"""
+
+    # the cached items are only formatted again, nothing is fetched
+    self.model.set_mode(self.disp_opts[i])
+
+  def cb_notify(self,method,data):
+    """apply playlist changes in place and follow the playing item"""
+
+    # while hidden only remember that the rows may no longer be current
+    method = str(method)
+    if not self.isVisible():
+      if method.startswith('Playlist.') or method=='Notifier.OnConnect':
+        self.stale = True
+      return
+    m = self.model
+
+    # after (re)connecting we may have missed changes, so start over
+    if method=='Notifier.OnConnect':
+      self.refresh()
+
+    # a new item started; this also catches a playlist that changed under us
+    elif method=='Player.OnPlay':
+      self.refresh(False)
+
+    # apply adds and removes as row deltas, refetching everything on a gap
+    elif (method.startswith('Playlist.') and isinstance(data,dict) and
+          data.get('playlistid')==m.plid):
+      pos = data.get('position',0)
+      if method=='Playlist.OnAdd':
+        ok = m.insert(pos)
+        if ok and pos<self.current:
+          self.current += 1
+      elif method=='Playlist.OnRemove':
+        ok = m.remove(pos)
+        if ok and pos<self.current-1:
+          self.current -= 1
+      elif method=='Playlist.OnClear':
+        (ok,self.current) = (True,0)
+        m.reset(m.plid,0)
+      else:
+        ok = True
+      if not ok:
+        self.refresh()
+      self.show_label()
+
+  def refresh(self,force=True):
+    """fetch the playlist on the worker pool, fill() is called when it arrives"""
+
+    p = self.parent()
+    p.run(p.ctrl.get_playlist,(),lambda info:self.fill(info,force),
+        self.label.setText)
+
+  def fill(self,info,force=True):
+    """update the label and the list from get_playlist() results"""
+
+    # update the label for current playlist position and shuffled flag
+    (self.current,self.shuffled) = (info['current'],info['shuffled'])
+
+    # the rows themselves are fetched by the model as they come into view;
+    # cached rows are kept unless the playlist is not the one we have
+    m = self.model
+    if force or (info['playlistid'],info['size'])!=(m.plid,m.size):
+      m.reset(info['playlistid'],info['size'])
+    self.show_label()
+
+  def show_label(self):
+    """show the current playlist position and shuffled flag"""
+
+    text = 'Current item: %s / %i' % (self.current,self.model.size)
+    if self.shuffled:
+      text += ' (Shuffled)'
+    self.label.setText(text)
 
 ################################################################################
-# Helper functions                                                             #
+# Library search dialog class                                                  #
 ################################################################################
 
-def get(x,k,d):
-  """get key k from dict d but return default d if it doesn't exist or empty"""
-  
-  v = x.get(k,d)
-  if len(v.strip())==0:
-    return d
-  return v
+class LibraryDialog(QtGui.QDialog):
 
-def time2sec(t):
-  """convert an xbmc time dict to seconds"""
-  
-  return 3600*t['hours']+60*t['minutes']+t['seconds']
+  # dropdown choices mapped to the library kinds they search
+  KINDS = odict([('All',None),('Artists','artist'),('Albums','album'),
+                 ('Songs','song'),('Movies','movie'),('Episodes','episode')])
 
-def sec2time(t):
-  """convert seconds to an xbmc time dict"""
-  
-  h = t/3600
-  t -= 3600*h
-  m = t/60
-  t -= 60*m
-  return {'hours':h,'minutes':m,'seconds':t}
-
-def time2str(t):
-  """convert an xbmc time dict to a string"""
-  
-  s = ''
-  hr = str(t['hours'])
-  mi = str(t['minutes'])
-  sec = str(t['seconds'])
-  if t['hours']>0:
-    s += (hr+':')
-    s+= (mi.zfill(2)+':')
-  else:
-    s+= (mi+':')
-  s+= sec.zfill(2)
-  return s
+  def __init__(self,parent):
+
+    super(LibraryDialog,self).__init__(parent)
+    self.rows = []
+    self.initUI()
+    self.show()
+
+  def initUI(self):
+    """create the search box, results table and buttons"""
+
+    # create a grid layout
+    grid = QtGui.QGridLayout()
+    grid.setSpacing(10)
+    self.setLayout(grid)
+
+    # results are looked up in the local index on every keystroke
+    self.search_box = QtGui.QLineEdit(self)
+    self.search_box.textChanged.connect(self.search)
+    grid.addWidget(self.search_box,0,0,1,3)
+    self.kind_box = QtGui.QComboBox(self)
+    self.kind_box.addItems(list(self.KINDS))
+    self.kind_box.currentIndexChanged.connect(self.search)
+    grid.addWidget(self.kind_box,0,3)
+
+    # one row per result; double-click or select and enqueue
+    self.table = QtGui.QTableWidget(0,3,self)
+    self.table.setHorizontalHeaderLabels(['Type','Title','Details'])
+    self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+    self.table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+    self.table.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+    self.table.verticalHeader().hide()
+    self.table.horizontalHeader().setStretchLastSection(True)
+    self.table.doubleClicked.connect(self.enqueue)
+    self.table.setMinimumSize(600,300)
+    grid.addWidget(self.table,1,0,1,4)
+
+    # a label for counts and timings, and the buttons
+    self.label = QtGui.QLabel('',self)
+    grid.addWidget(self.label,2,0)
+    for (col,name) in enumerate(['Sync','Enqueue','Close']):
+      self.make_button(grid,name,2,col+1)
+
+    # catch up with the library, then follow host changes
+    self.setWindowTitle('Library')
+    self.sync()
+    self.parent().notification.connect(self.cb_notify)
+
+  def make_button(self,grid,name,row,col):
+    """helper function to create a button and add it to the grid"""
+
+    button = QtGui.QPushButton(name,self)
+    button.clicked.connect(self.cb_button)
+    button.resize(button.sizeHint())
+    grid.addWidget(button,row,col)
+
+  def cb_button(self):
+    """act on button presses"""
+
+    b = self.sender().text()
+    if b=='Sync':
+      self.sync()
+    elif b=='Enqueue':
+      self.enqueue()
+    elif b=='Close':
+      self.close()
+
+  def cb_notify(self,method,data):
+    """catch up with the index of the host selected in the main window"""
+
+    if self.isVisible() and str(method)=='Notifier.OnConnect':
+      self.reopen()
+
+  def reopen(self):
+    """keep the last results and catch up with the library in the background"""
+
+    self.sync()
+
+  def sync(self):
+    """fetch what was added to the library on the worker pool"""
+
+    # the index is asked for every time since the main window replaces it
+    # when the host changes, also when the options are saved
+    p = self.parent()
+    self.label.setText('Syncing...')
+    p.run(p.open_library().sync,(p.ctrl.conn,),self.synced,self.label.setText)
+
+  def synced(self,n):
+    """show the size of the index and search it again"""
+
+    self.search()
+    if not self.search_box.text():
+      counts = self.parent().open_library().counts()
+      self.label.setText(', '.join(['%i %ss' % (v,k) for (k,v) in counts.items()]))
+
+  def search(self,*args):
+    """look up the search text in the index and show the results"""
+
+    text = unicode(self.search_box.text())
+    kind = self.KINDS[str(self.kind_box.currentText())]
+    start = time.time()
+    self.rows = self.parent().open_library().search(text,kind)
+    msecs = 1000*(time.time()-start)
+
+    self.table.setRowCount(len(self.rows))
+    for (row,(kind,i,label,detail)) in enumerate(self.rows):
+      for (col,text) in enumerate([kind.title(),label,detail]):
+        self.table.setItem(row,col,QtGui.QTableWidgetItem(text))
+    self.table.resizeColumnToContents(0)
+    if self.search_box.text():
+      self.label.setText('%i found in %.1f ms' % (len(self.rows),msecs))
+
+  def enqueue(self,*args):
+    """add the selected results to the end of their playlists"""
+
+    rows = sorted(set([x.row() for x in self.table.selectedIndexes()]))
+    items = [self.rows[row][:2] for row in rows]
+    if items:
+      p = self.parent()
+      p.run(p.ctrl.enqueue,(items,),self.label.setText)
+
+################################################################################
+# Diagnostics dialog class                                                     #
+################################################################################
+
+class DiagDialog(QtGui.QDialog):
+
+  # table columns as (heading,function of stats and method counters)
+  COLUMNS = (('Calls',lambda s,m: str(m['calls'])),
+             ('Errors',lambda s,m: str(m['errors'])),
+             ('Avg ms',lambda s,m: '%.1f' % (1000*m['seconds']/m['calls'])),
+             ('p50 ms',lambda s,m: '<%g' % (1000*s.quantile(m,0.50))),
+             ('p95 ms',lambda s,m: '<%g' % (1000*s.quantile(m,0.95))),
+             ('Bytes out',lambda s,m: str(m['bytes_out'])),
+             ('Bytes in',lambda s,m: str(m['bytes_in'])))
+
+  def __init__(self,parent):
+
+    super(DiagDialog,self).__init__(parent)
+    self.initUI()
+    self.show()
+
+  def initUI(self):
+    """create the table and buttons"""
+
+    # create a grid layout
+    grid = QtGui.QGridLayout()
+    grid.setSpacing(10)
+    self.setLayout(grid)
+
+    # one row per method (or batch of methods) with its counters
+    headings = ['Method']+[c[0] for c in self.COLUMNS]
+    self.table = QtGui.QTableWidget(0,len(headings),self)
+    self.table.setHorizontalHeaderLabels(headings)
+    self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+    self.table.verticalHeader().hide()
+    self.table.setMinimumWidth(700)
+    grid.addWidget(self.table,0,0,1,5)
+
+    # create the buttons
+    for (col,name) in enumerate(['Reset','Export JSON...','Export Prometheus...',
+                                 'Close']):
+      self.make_button(grid,name,1,col+1)
+
+    # the counters keep changing, so refresh them while we are open
+    self.timer = QtCore.QTimer(self)
+    self.timer.timeout.connect(self.fill)
+    self.timer.start(1000)
+    self.fill()
+    self.setWindowTitle('Diagnostics')
+
+  def make_button(self,grid,name,row,col):
+    """helper function to create a button and add it to the grid"""
+
+    button = QtGui.QPushButton(name,self)
+    button.clicked.connect(self.cb_button)
+    button.resize(button.sizeHint())
+    grid.addWidget(button,row,col)
+
+  def reopen(self):
+    """start refreshing again"""
+
+    self.fill()
+    self.timer.start(1000)
+
+  def stats(self):
+    """the counters of the current connection"""
+
+    return self.parent().ctrl.conn.stats
+
+  def fill(self):
+    """show the current counters"""
+
+    stats = self.stats()
+    methods = stats.snapshot()
+    self.table.setRowCount(len(methods))
+    for (row,(method,m)) in enumerate(methods.items()):
+      self.table.setItem(row,0,QtGui.QTableWidgetItem(method))
+      for (col,(name,func)) in enumerate(self.COLUMNS):
+        item = QtGui.QTableWidgetItem(func(stats,m))
+        item.setTextAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignVCenter)
+        self.table.setItem(row,col+1,item)
+    self.table.resizeColumnsToContents()
+
+  def cb_button(self):
+    """act on button presses"""
+
+    b = self.sender().text()
+    if b=='Reset':
+      self.stats().reset()
+      self.fill()
+    elif b=='Export JSON...':
+      self.export('JSON (*.json)','xbmc-rpc.json',self.stats().to_json)
+    elif b=='Export Prometheus...':
+      self.export('Prometheus (*.prom)','xbmc-rpc.prom',
+          self.stats().to_prometheus)
+    elif b=='Close':
+      self.close()
+
+  def export(self,filt,name,func):
+    """ask for a file name and write the output of func to it"""
+
+    fname = QtGui.QFileDialog.getSaveFileName(self,'Export',name,filt)
+    if not fname:
+      return
+    try:
+      with open(str(fname),'w') as f:
+        f.write(func())
+    except IOError as e:
+      QtGui.QMessageBox.warning(self,'Export failed',str(e))
+
+  def closeEvent(self,event):
+    """stop refreshing once closed"""
+
+    self.timer.stop()
+    super(DiagDialog,self).closeEvent(event)
 
 ################################################################################
 # Main                                                                         #
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# This client is kept to the bare minimum of imports so a keybinding costs
+# little more than interpreter startup; the work is done by "xbmcctl.py -d"
+
+import sys,os,socket
+
+# where the daemon listens, private to the user
+SOCKET = os.environ.get('XBMCCTL_SOCKET') or os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or '/tmp','xbmcctl-%i.sock' % os.getuid())
+
+def send(words,path=SOCKET):
+  """send a command to the daemon; return (ok,text) or None if it is not up"""
+
+  sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+  except socket.error:
+    return None
+
+  # the reply is an exit status line followed by the text, then EOF
+  sock.sendall(' '.join(words)+'\n')
+  data = ''
+  while True:
+    chunk = sock.recv(4096)
+    if not chunk:
+      break
+    data += chunk
+  sock.close()
+  (status,text) = data.split('\n',1)
+  return (status=='0',text)
+
+def main(args):
+
+  if len(args)<2 or args[1] in ('-h','--help'):
+    print('usage: %s command [number]' % os.path.basename(args[0]))
+    sys.exit(2)
+
+  # without a daemon run the command directly, which is slower but works
+  reply = send(args[1:])
+  if reply is None:
+    ctl = os.path.join(os.path.dirname(os.path.abspath(__file__)),'xbmcctl.py')
+    os.execv(sys.executable,[sys.executable,ctl]+args[1:])
+
+  (ok,text) = reply
+  (sys.stdout if ok else sys.stderr).write(text)
+  sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+  main(sys.argv)
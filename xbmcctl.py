@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import sys,os,argparse,signal
+from SocketServer import ThreadingUnixStreamServer,StreamRequestHandler
+
+from xbmcc import SOCKET,send
+
+# command names mapped to (Controller method,args); None means the command
+# takes one number, e.g. "seek -30" or "volume 10"
+COMMANDS = {'pause'    : ('playpause',()),
+            'stop'     : ('stop',()),
+            'mute'     : ('mute',()),
+            'back'     : ('hop',('back',)),
+            'fore'     : ('hop',('fore',)),
+            'prev'     : ('jump',('prev',)),
+            'next'     : ('jump',('next',)),
+            'vol-'     : ('volume',('down',)),
+            'vol+'     : ('volume',('up',)),
+            'seek'     : ('seek',None),
+            'volume'   : ('change_volume',None),
+            'info'     : ('get_info',()),
+            'playlist' : ('get_playlist',())}
+
+################################################################################
+# Commands                                                                     #
+################################################################################
+
+def parse(words):
+  """return (method name,args) for a command; raise ValueError if invalid"""
+
+  if not words or words[0] not in COMMANDS:
+    raise ValueError('unknown command: %s' % ' '.join(words))
+  (method,args) = COMMANDS[words[0]]
+  if args is None:
+    if len(words)!=2:
+      raise ValueError('%s takes one number' % words[0])
+    args = (int(words[1]),)
+  elif len(words)!=1:
+    raise ValueError('%s takes no arguments' % words[0])
+  return (method,args)
+
+def describe(method,result):
+  """the result of a command as text, the way the GUI would show it"""
+
+  if method=='get_playlist':
+    text = 'Current item: %s / %i' % (result['current'],result['size'])
+    if result['shuffled']:
+      text += ' (Shuffled)'
+    return text
+  elif isinstance(result,dict):
+    return '\n'.join(['%s: %s' % (k,v) for (k,v) in result.items()])
+  return result
+
+def run(group,words):
+  """run one command on every host of group; return (ok,text)"""
+
+  from xbmcrpc import XBMCException,error_msg
+
+  command = ' '.join(words)
+  try:
+    (method,args) = parse(words)
+  except ValueError as e:
+    return (False,'%s: %s' % (command,e.message))
+
+  # with more than one host every line says which host it is from
+  results = group.call(method,args)
+  (ok,lines) = (True,[])
+  for (name,result) in results:
+    if isinstance(result,XBMCException):
+      (ok,text) = (False,'%s: %s' % (command,error_msg(result)))
+    else:
+      text = describe(method,result)
+    for line in text.split('\n'):
+      lines.append(name+': '+line if len(results)>1 else line)
+  return (ok,'\n'.join(lines))
+
+def execute(group,words):
+  """run one command and print its result; return False if it failed"""
+
+  (ok,text) = run(group,words)
+  (sys.stdout if ok else sys.stderr).write(text+'\n')
+  sys.stdout.flush()
+  return ok
+
+def commands(f):
+  """split lines from f into commands, skipping blank lines and comments"""
+
+  # readline() instead of iterating so each command runs as soon as it arrives
+  for line in iter(f.readline,''):
+    words = line.split('#')[0].split()
+    if words:
+      yield words
+
+################################################################################
+# Daemon                                                                       #
+################################################################################
+
+class Handler(StreamRequestHandler):
+
+  def handle(self):
+    """run one command per connection and reply with its status and text"""
+
+    words = self.rfile.readline().split()
+    (ok,text) = run(self.server.group,words)
+    self.wfile.write('%i\n%s\n' % (int(not ok),text))
+
+class Daemon(ThreadingUnixStreamServer):
+  daemon_threads = True
+
+def daemon(group,path):
+  """answer commands from xbmcc.py on a Unix socket until terminated"""
+
+  # refuse to take over the socket of a daemon that is still running
+  if os.path.exists(path):
+    if send(['ping'],path) is not None:
+      sys.exit('already running on %s' % path)
+    os.remove(path)
+
+  # only our own user may connect
+  umask = os.umask(0o077)
+  try:
+    server = Daemon(path,Handler)
+  finally:
+    os.umask(umask)
+  server.group = group
+
+  # turn SIGTERM into a clean exit so the socket gets removed
+  signal.signal(signal.SIGTERM,lambda sig,frame: sys.exit(0))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    os.remove(path)
+
+################################################################################
+# Main                                                                         #
+################################################################################
+
+def main(args):
+
+  parser = argparse.ArgumentParser(description='control XBMC without the GUI',
+      epilog='commands: '+', '.join(sorted(COMMANDS)))
+  parser.add_argument('-c',help='path to config file',metavar='file')
+  parser.add_argument('--host',
+      help='host name from the config file, an address, or "all"')
+  parser.add_argument('-d','--daemon',action='store_true',
+      help='keep running and take commands from xbmcc.py')
+  parser.add_argument('-s',default=SOCKET,help='daemon socket path',
+      metavar='path')
+  parser.add_argument('command',nargs='*',
+      help='command to run, or none to read commands from stdin')
+  args = parser.parse_args(args[1:])
+
+  # import the RPC module only once we know there is work to do
+  from xbmcrpc import CONFIG,ControllerGroup,read_config,parse_hosts
+  opts = read_config(args.c or CONFIG)
+
+  # talk to the first configured host unless told otherwise
+  hosts = parse_hosts(opts)
+  name = args.host or list(hosts)[0]
+  if name!='all':
+    opts['hosts'] = '%s=%s' % (name,hosts.get(name,name))
+
+  # a one-shot command has no use for notifications, but the daemon keeps
+  # the state model current between commands if they are enabled
+  if not args.daemon:
+    opts['use_notify'] = '0'
+  group = ControllerGroup(opts)
+
+  # run the command line, or every command on stdin over the same connection
+  try:
+    if args.daemon:
+      daemon(group,args.s)
+      ok = True
+    elif args.command:
+      ok = execute(group,args.command)
+    else:
+      ok = all([execute(group,words) for words in commands(sys.stdin)])
+  finally:
+    group.close()
+  sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,2368 @@
+#!/usr/bin/env python
+
+import os,bisect,hashlib,json,re,socket,sqlite3,struct,threading,time
+from ConfigParser import SafeConfigParser
+from collections import OrderedDict as odict
+
+# Custom exception for catching communication errors with XBMC
+class XBMCException(Exception):
+  pass
+
+# Error message returned by XBMC itself, as opposed to a transport failure
+class ResponseError(XBMCException):
+  pass
+
+# XBMC could not be reached at all, or is known to be down
+class TransportError(XBMCException):
+  pass
+
+# Custom file descriptor for use with SafeConfigParser to insert a dummy section
+# (the library requires [Sections] in config file but I don't want any)
+class FakeSecHead(object):
+    def __init__(self, fp):
+        self.fp = fp
+        self.sechead = '[dummy]\n'
+    def readline(self):
+        if self.sechead:
+            try: 
+                return self.sechead
+            finally: 
+                self.sechead = None
+        else: 
+            return self.fp.readline()
+
+################################################################################
+# Configuration                                                                #
+################################################################################
+
+# the config file next to the scripts, shared by the GUI and the CLI
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),'remote.conf')
+
+# default options for the connection and actions; the GUI adds its key options
+DEFAULTS = odict([ ('xbmc_ip','127.0.0.1'),
+                   ('hosts',''),
+                   ('xbmc_user',''),
+                   ('xbmc_pass',''),
+                   ('timeout_conn',3.05),
+                   ('timeout_read',10),
+                   ('use_notify',0),
+                   ('xbmc_tcp',9090),
+                   ('transport','get'),
+                   ('pid_ttl',2),
+                   ('rel_cmds',1),
+                   ('step_back',10),
+                   ('step_fore',10),
+                   ('def_plist',0),
+                   ('sync_secs',10) ])
+
+def read_config(fname,defaults=DEFAULTS):
+  """return the defaults as strings updated with the options in fname"""
+
+  # start with defaults, a missing file leaves them as they are
+  opts = odict([(k,str(v)) for (k,v) in defaults.items()])
+  if not os.path.isfile(fname):
+    return opts
+
+  # read options from the config file into a dict
+  conf = SafeConfigParser()
+  with open(fname) as f:
+    conf.readfp(FakeSecHead(f))
+
+  # only take options we know about, and macros with their keys
+  for (opt,val) in conf.items('dummy'):
+    if opt in opts or opt.startswith(MACRO) or opt.startswith('key_'+MACRO):
+      opts[opt] = val
+  return opts
+
+def parse_hosts(opts):
+  """return an odict of host names to addresses from the hosts option"""
+
+  # hosts is a comma separated list of name=address or plain addresses; if it
+  # is empty the only host is xbmc_ip (addresses may start with get://,
+  # post:// or tcp:// to pick a transport other than the transport option)
+  hosts = odict()
+  for entry in opts.get('hosts','').split(','):
+    entry = entry.strip()
+    if entry:
+      (name,addr) = entry.split('=',1) if '=' in entry else (entry,entry)
+      hosts[name.strip()] = addr.strip()
+  return hosts or odict([(opts['xbmc_ip'],opts['xbmc_ip'])])
+
+################################################################################
+# Connection class                                                             #
+################################################################################
+
+class Connection(object):
+
+  def __init__(self,host,user='',pw='',timeout=(3.05,10),pool=4,
+      transport='get',tcp_port=9090):
+    """create a persistent connection to the given host over a transport"""
+
+    (kind,addr) = split_address(host,transport,tcp_port)
+    self.timeout = timeout
+    self.stats = Stats(addr)
+    self.health = Health(self.ping)
+    if kind=='tcp':
+      self.transport = TCPTransport(addr,timeout)
+    else:
+      self.transport = TRANSPORTS[kind](addr,user,pw,timeout,pool)
+
+    # files such as artwork only come over HTTP, so the TCP transport gets
+    # an HTTP one for them the first time one is needed; a plain address
+    # with a port is the web server's, while a tcp:// one names the TCP port
+    # and then, as without a port, the web server is on XBMC's default port
+    self.files = None if kind=='tcp' else self.transport
+    self.http = host.split('://')[-1]
+    if kind=='tcp' and ('://' in host or ':' not in self.http):
+      self.http = '%s:%i' % (self.http.split(':')[0],HTTP_PORT)
+    self.auth = (user,pw)
+
+  def request(self,method,params=None):
+    """make a request to the XBMC JSON-RPC web interface"""
+
+    # raise the JSON error message, or return the contents of the 'result' field
+    r = self.send(call(method,params))
+    if 'error' in r:
+      raise ResponseError(r['error']['message'])
+    return r['result']
+
+  def batch(self,calls,strict=True):
+    """send a list of (method,params) tuples in a single JSON-RPC batch"""
+
+    # give every call a distinct id so the responses can be mapped back
+    if not calls:
+      return []
+    payload = [call(method,params,i) for (i,(method,params)) in enumerate(calls)]
+    responses = self.send(payload)
+    if not isinstance(responses,list):
+      raise XBMCException(responses.get('error',{}).get('message','Bad batch'))
+    by_id = dict([(r.get('id'),r) for r in responses])
+
+    # return results in call order; errors are raised or returned in place
+    results = []
+    for i in range(0,len(calls)):
+      r = by_id.get(i,{'error':{'message':'No response'}})
+      if 'error' in r:
+        e = ResponseError(r['error']['message'])
+        if strict:
+          raise e
+        results.append(e)
+      else:
+        results.append(r['result'])
+    return results
+
+  def send(self,payload):
+    """send a JSON-RPC payload and return the decoded response"""
+
+    # fail at once while the host is down rather than wait for a timeout
+    self.health.check()
+    return self.transfer(payload)
+
+  def ping(self):
+    """return True if the host answers at all, even with an error"""
+
+    try:
+      self.transfer(call('JSONRPC.Ping'))
+    except TransportError:
+      return False
+    except XBMCException:
+      pass
+    return True
+
+  def transfer(self,payload):
+    """do the round trip for send() and keep the health and stats current"""
+
+    # every request of the round trip is recorded, failed ones as errors
+    requests = payload if isinstance(payload,list) else [payload]
+    (sent,received,errors) = (0,0,[True]*len(requests))
+    start = time.time()
+    try:
+
+      # only a transport failure says the host is gone, an HTTP error does not
+      try:
+        (result,sent,received) = self.transport.exchange(payload)
+      except TransportError:
+        self.health.failure()
+        raise
+      except XBMCException:
+        self.health.success()
+        raise
+      self.health.success()
+
+      responses = result if isinstance(result,list) else [result]
+      failed = dict([(r.get('id'),'error' in r) for r in responses])
+      errors = [failed.get(x.get('id'),True) for x in requests]
+      return result
+
+    finally:
+      self.stats.record_batch([x['method'] for x in requests],
+          time.time()-start,sent,received,errors)
+
+  def stream_items(self,method,params=None,key='items'):
+    """make a request and yield the elements of result[key] as they arrive"""
+
+    # transports that cannot stream still answer, just all at once
+    if not hasattr(self.transport,'chunks'):
+      for item in self.request(method,params).get(key,[]):
+        yield item
+      return
+
+    # the same health and stats bookkeeping as transfer(), except that the
+    # host can also drop out halfway through the body
+    self.health.check()
+    (sent,received,error) = (0,0,True)
+    start = time.time()
+    try:
+      try:
+        (sent,chunks) = self.transport.chunks(call(method,params))
+      except TransportError:
+        self.health.failure()
+        raise
+      except XBMCException:
+        self.health.success()
+        raise
+      self.health.success()
+
+      # only the element being decoded and the rest of the response are
+      # held, however many items there are
+      decoder = ItemStream(('result',key))
+      try:
+        for data in chunks:
+          received += len(data)
+          for item in decoder.feed(data):
+            yield item
+      except TransportError:
+        self.health.failure()
+        raise
+      r = decoder.close()
+      if 'error' in r:
+        raise ResponseError(r['error']['message'])
+      error = False
+
+    finally:
+      self.stats.record(method,time.time()-start,sent,received,error)
+
+  def download(self,path):
+    """return the contents of a file XBMC offers, e.g. by Files.PrepareDownload"""
+
+    self.health.check()
+    if self.files is None:
+      self.files = HTTPGet(self.http,self.auth[0],self.auth[1],self.timeout,1)
+    (sent,received,error) = (0,0,True)
+    start = time.time()
+    try:
+      try:
+        data = self.files.download(path)
+      except TransportError:
+        self.health.failure()
+        raise
+      self.health.success()
+      (received,error) = (len(data),False)
+      return data
+    finally:
+      self.stats.record('download',time.time()-start,sent,received,error)
+
+  def close(self):
+    """close the transport and stop probing"""
+
+    self.health.stop()
+    self.transport.close()
+    if self.files not in (None,self.transport):
+      self.files.close()
+
+################################################################################
+# Transports                                                                   #
+################################################################################
+
+# A transport has exchange(payload), which sends a request object or batch and
+# returns (response,bytes sent,bytes received), and close(). Failures to reach
+# the host raise TransportError, any other problem XBMCException. Transports
+# that can hand out the response body as it arrives also have chunks(payload),
+# which returns (bytes sent,iterator over pieces of the body).
+
+class HTTPGet(object):
+
+  def __init__(self,host,user,pw,timeout,pool):
+    """JSON-RPC over HTTP with the request in the query string"""
+
+    # imported here since it is the slowest import and not every user needs it
+    import requests
+
+    self.url = 'http://'+host+'/jsonrpc'
+    self.timeout = timeout
+
+    # auth and headers are built once and sent with every request
+    self.session = requests.Session()
+    self.session.auth = (user,pw)
+    self.session.headers.update({'content-type':'application/json'})
+
+    # we only ever talk to one host, so one pool with a few warm sockets
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,pool_maxsize=pool)
+    self.session.mount('http://',adapter)
+
+  def exchange(self,payload):
+    """send a request over HTTP and return the decoded response"""
+
+    body = json.dumps(payload)
+
+    # catch ConnectionError exceptions from requests library
+    try:
+      r = self.http(body)
+    except Exception as e:
+      raise TransportError(e.__class__.__name__)
+
+    # catch HTTP error responses (e.g. 401 Forbidden)
+    if not r.ok:
+      raise XBMCException('HTTP %i - %s' % (r.status_code,r.reason))
+    return (json.loads(r.text),len(body),len(r.content))
+
+  def chunks(self,payload,size=65536):
+    """send a request over HTTP and return the body piece by piece"""
+
+    body = json.dumps(payload)
+    try:
+      r = self.http(body,stream=True)
+    except Exception as e:
+      raise TransportError(e.__class__.__name__)
+    if not r.ok:
+      r.close()
+      raise XBMCException('HTTP %i - %s' % (r.status_code,r.reason))
+    return (len(body),self.read(r,size))
+
+  def download(self,path):
+    """return the contents of a file from the XBMC web server"""
+
+    url = self.url[:-len('jsonrpc')]+path.lstrip('/')
+    try:
+      r = self.session.get(url,timeout=self.timeout)
+    except Exception as e:
+      raise TransportError(e.__class__.__name__)
+    if not r.ok:
+      raise XBMCException('HTTP %i - %s' % (r.status_code,r.reason))
+    return r.content
+
+  def read(self,r,size):
+    """yield the body of a streamed response and release its socket"""
+
+    try:
+      for data in r.iter_content(size):
+        yield data
+    except Exception as e:
+      raise TransportError(e.__class__.__name__)
+    finally:
+      r.close()
+
+  def http(self,body,stream=False):
+    """do the HTTP request"""
+
+    return self.session.get(self.url,params={'request':body},
+        timeout=self.timeout,stream=stream)
+
+  def close(self):
+    """close all pooled sockets"""
+
+    self.session.close()
+
+class HTTPPost(HTTPGet):
+
+  def http(self,body,stream=False):
+    """do the HTTP request with the JSON as the body, which is not URL-encoded"""
+
+    return self.session.post(self.url,data=body,timeout=self.timeout,
+        stream=stream)
+
+class TCPTransport(object):
+
+  # how often the reaper looks for overdue requests, in seconds
+  TICK = 0.1
+
+  def __init__(self,host,timeout):
+    """JSON-RPC over one persistent socket with many requests in flight"""
+
+    (addr,port) = host.rsplit(':',1)
+    self.addr = (addr,int(port))
+    self.timeout = timeout
+
+    # responses are matched to waiting callers by our own request ids; the
+    # write lock only keeps requests whole, the reader never needs it
+    self.lock = threading.RLock()
+    self.write_lock = threading.Lock()
+    self.sock = None
+    self.next_id = 0
+    self.pending = {}
+
+    # callers' deadlines and the send in progress as (socket,start), watched
+    # by one reaper thread while anything is waiting
+    self.deadlines = {}
+    self.sending = None
+    self.reaper = None
+
+  def exchange(self,payload):
+    """send a request without waiting for others and wait for its response"""
+
+    calls = payload if isinstance(payload,list) else [payload]
+    waiter = Waiter()
+
+    # give every call a unique id and register it before anything is sent, so
+    # the reader can hand the response over as soon as it arrives
+    with self.lock:
+      (ids,ours) = ({},[])
+      for c in calls:
+        self.next_id += 1
+        ids[self.next_id] = c.get('id')
+        self.pending[self.next_id] = waiter
+        ours.append(dict(c,id=self.next_id))
+      self.deadlines[waiter] = time.time()+self.timeout[1]
+      if self.reaper is None:
+        self.reaper = threading.Thread(target=self.reap)
+        self.reaper.daemon = True
+        self.reaper.start()
+      try:
+        if self.sock is None:
+          self.connect()
+      except socket.error as e:
+        self.forget(ids,waiter)
+        raise TransportError('Timeout' if isinstance(e,socket.timeout)
+                             else 'ConnectionError')
+      sock = self.sock
+    body = json.dumps(ours if isinstance(payload,list) else ours[0])
+
+    # write the request out whole, outside the lock the reader needs so a
+    # large request and large responses can flow at the same time
+    try:
+      with self.write_lock:
+        self.sending = (sock,time.time())
+        try:
+          sock.sendall(body)
+        finally:
+          self.sending = None
+    except socket.error as e:
+      with self.lock:
+        self.forget(ids,waiter)
+      self.drop(sock,'ConnectionError')
+      raise TransportError('ConnectionError')
+
+    # the reader thread hands over the response, or the reaper the reason
+    # there is none; Event.wait() with a timeout polls in Python 2
+    waiter.event.wait()
+    with self.lock:
+      self.forget(ids,waiter)
+    if waiter.error is not None:
+      raise TransportError(waiter.error)
+
+    # put the caller's ids back
+    response = waiter.response
+    for r in (response if isinstance(response,list) else [response]):
+      r['id'] = ids.get(r.get('id'))
+    return (response,len(body),len(json.dumps(response)))
+
+  def forget(self,ids,waiter):
+    """stop waiting for the calls of one caller; hold the lock"""
+
+    for i in ids:
+      self.pending.pop(i,None)
+    self.deadlines.pop(waiter,None)
+
+  def reap(self):
+    """fail overdue callers and drop a socket a send is stuck on; runs in a
+    thread until nothing is waiting"""
+
+    while True:
+      time.sleep(self.TICK)
+      now = time.time()
+      with self.lock:
+        overdue = [w for (w,t) in self.deadlines.items() if t<=now]
+        for waiter in overdue:
+          del self.deadlines[waiter]
+        sending = self.sending
+        done = not self.deadlines and sending is None
+        if done:
+          self.reaper = None
+      for waiter in overdue:
+        waiter.fail('Timeout')
+      if sending is not None and sending[1]+self.timeout[1]<=now:
+        self.drop(sending[0],'Timeout')
+      if done:
+        return
+
+  def connect(self):
+    """open the socket and start reading responses from it"""
+
+    sock = socket.create_connection(self.addr,self.timeout[0])
+    sock.settimeout(None)
+
+    # small requests go out at once instead of waiting for earlier ACKs
+    sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    self.sock = sock
+    t = threading.Thread(target=self.read,args=(sock,))
+    t.daemon = True
+    t.start()
+
+  def read(self,sock):
+    """pass responses to their callers until the socket closes; runs in a thread"""
+
+    splitter = JSONSplitter()
+    try:
+      while True:
+        data = sock.recv(65536)
+        if not data:
+          break
+        for obj in splitter.feed(data):
+          self.dispatch(obj)
+    except (socket.error,ValueError):
+      pass
+    self.drop(sock,'ConnectionError')
+
+  def dispatch(self,obj):
+    """wake the caller of a response; notifications are ignored"""
+
+    first = obj[0] if isinstance(obj,list) and obj else obj
+    if not isinstance(first,dict) or first.get('id') is None:
+      return
+    with self.lock:
+      waiter = self.pending.get(first['id'])
+      for r in (obj if isinstance(obj,list) else [obj]):
+        self.pending.pop(r.get('id'),None)
+    if waiter is not None:
+      waiter.set(obj)
+
+  def drop(self,sock,error):
+    """forget a broken socket and fail everything that was waiting on it"""
+
+    with self.lock:
+      if sock is None or sock is not self.sock:
+        waiters = []
+      else:
+        waiters = set(self.pending.values())
+        self.pending = {}
+        self.sock = None
+        try:
+          sock.close()
+        except socket.error:
+          pass
+    for waiter in waiters:
+      waiter.fail(error)
+
+  def close(self):
+    """close the socket"""
+
+    with self.lock:
+      sock = self.sock
+    if sock is not None:
+      try:
+        sock.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+      self.drop(sock,'Closed')
+
+class Waiter(object):
+
+  def __init__(self):
+    """a response slot for a caller blocked in TCPTransport.exchange()"""
+
+    self.event = threading.Event()
+    self.lock = threading.Lock()
+    self.response = None
+    self.error = None
+
+  def set(self,response):
+    """hand over the response unless the caller already gave up"""
+
+    with self.lock:
+      if not self.event.is_set():
+        self.response = response
+        self.event.set()
+
+  def fail(self,error):
+    """give up with an error message unless there already is a response"""
+
+    with self.lock:
+      if not self.event.is_set():
+        self.error = error
+        self.event.set()
+
+TRANSPORTS = {'get':HTTPGet,'post':HTTPPost,'tcp':TCPTransport}
+
+# the port XBMC's web server listens on unless configured otherwise
+HTTP_PORT = 8080
+
+def split_address(host,transport='get',tcp_port=9090):
+  """return (transport,address) for an address with an optional scheme prefix"""
+
+  explicit = '://' in host
+  if explicit:
+    (transport,host) = host.split('://',1)
+  if transport not in TRANSPORTS:
+    raise XBMCException('Unknown transport: %s' % transport)
+
+  # TCP goes to the xbmc_tcp port unless the address names its own
+  if transport=='tcp' and not (explicit and ':' in host):
+    host = '%s:%i' % (host.split(':')[0],tcp_port)
+  return (transport,host)
+
+################################################################################
+# Health tracking                                                              #
+################################################################################
+
+class Health(object):
+
+  # consecutive failures that open the circuit, and the probe backoff range
+  THRESHOLD = 2
+  BACKOFF = (1,60)
+
+  def __init__(self,probe):
+    """a circuit breaker; probe() returns True once the host is back"""
+
+    self.probe = probe
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+
+    # connected is None until the first request tells us either way
+    self.connected = None
+    self.failures = 0
+    self.retry = 0
+
+    # functions called with the new connected state when it changes
+    self.listeners = []
+
+  def check(self):
+    """raise TransportError while the circuit is open"""
+
+    if self.connected is False:
+      wait = max(1,int(round(self.retry-time.time())))
+      raise TransportError('Disconnected, retrying in %i s' % wait)
+
+  def success(self):
+    """a round trip worked; close the circuit"""
+
+    with self.lock:
+      self.failures = 0
+      changed = self.connected is not True
+      self.connected = True
+    if changed:
+      self.changed()
+
+  def failure(self):
+    """a round trip failed; open the circuit after enough of them in a row"""
+
+    # a host we never reached is taken as down on the first failure
+    with self.lock:
+      self.failures += 1
+      changed = (self.connected is None or (self.connected and
+                 self.failures>=self.THRESHOLD))
+      if changed:
+        self.connected = False
+        self.retry = time.time()+self.BACKOFF[0]
+    if changed:
+      t = threading.Thread(target=self.recover)
+      t.daemon = True
+      t.start()
+      self.changed()
+
+  def recover(self):
+    """probe with exponential backoff until the host is back; runs in a thread"""
+
+    delay = self.BACKOFF[0]
+    while not self.connected:
+      self.retry = time.time()+delay
+      if self.stopped.wait(delay):
+        return
+      if self.probe():
+        return
+      delay = min(2*delay,self.BACKOFF[1])
+
+  def changed(self):
+    """tell the listeners about a new state"""
+
+    for func in self.listeners:
+      func(self.connected)
+
+  def stop(self):
+    """end any probing"""
+
+    self.stopped.set()
+
+  def __str__(self):
+    """the state for display"""
+
+    return {None:'Connecting...',True:'Connected',False:'Disconnected'}[
+        self.connected]
+
+################################################################################
+# Instrumentation                                                              #
+################################################################################
+
+class Stats(object):
+
+  # upper bounds of the latency histogram buckets in seconds
+  BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+
+  def __init__(self,host):
+    """per-method counters for the requests sent to one host"""
+
+    self.host = host
+    self.lock = threading.Lock()
+    self.methods = {}
+
+  def record(self,method,seconds,sent,received,error):
+    """add one round trip to the counters of method"""
+
+    with self.lock:
+      m = self.methods.get(method)
+      if m is None:
+        m = {'calls':0,'errors':0,'bytes_out':0,'bytes_in':0,'seconds':0.0,
+             'buckets':[0]*(len(self.BUCKETS)+1)}
+        self.methods[method] = m
+      m['calls'] += 1
+      m['errors'] += int(error)
+      m['bytes_out'] += sent
+      m['bytes_in'] += received
+      m['seconds'] += seconds
+      m['buckets'][bisect.bisect_left(self.BUCKETS,seconds)] += 1
+
+  def record_batch(self,methods,seconds,sent,received,errors):
+    """add a round trip carrying several requests to the counters of each;
+    they share its time and split its bytes"""
+
+    n = len(methods)
+    for (i,(method,error)) in enumerate(zip(methods,errors)):
+      self.record(method,seconds,sent/n+int(i<sent%n),
+          received/n+int(i<received%n),error)
+
+  def reset(self):
+    """forget everything recorded so far"""
+
+    with self.lock:
+      self.methods = {}
+
+  def snapshot(self):
+    """return a copy of the counters sorted by method"""
+
+    with self.lock:
+      return odict([(k,dict(v,buckets=list(v['buckets'])))
+                    for (k,v) in sorted(self.methods.items())])
+
+  def quantile(self,m,q):
+    """estimate a quantile from a histogram as the bound of its bucket"""
+
+    n = 0
+    for (i,count) in enumerate(m['buckets']):
+      n += count
+      if n>=q*m['calls']:
+        break
+    return self.BUCKETS[i] if i<len(self.BUCKETS) else float('inf')
+
+  def to_json(self):
+    """the counters as a JSON document"""
+
+    return json.dumps({'host':self.host,'buckets':self.BUCKETS,
+                       'methods':self.snapshot()},indent=2)
+
+  def to_prometheus(self):
+    """the counters in the Prometheus text exposition format"""
+
+    counters = (('calls','requests_total','JSON-RPC requests sent'),
+                ('errors','errors_total','JSON-RPC requests that failed'),
+                ('bytes_out','sent_bytes_total','JSON request bytes sent'),
+                ('bytes_in','received_bytes_total','JSON response bytes received'))
+    methods = self.snapshot()
+    lines = []
+    for (key,name,text) in counters:
+      lines.append('# HELP xbmc_rpc_%s %s' % (name,text))
+      lines.append('# TYPE xbmc_rpc_%s counter' % name)
+      for (method,m) in methods.items():
+        lines.append('xbmc_rpc_%s{%s} %i' % (name,self.labels(method),m[key]))
+
+    # histogram buckets are cumulative in this format
+    lines.append('# HELP xbmc_rpc_latency_seconds JSON-RPC round trip time')
+    lines.append('# TYPE xbmc_rpc_latency_seconds histogram')
+    for (method,m) in methods.items():
+      n = 0
+      for (bound,count) in zip(self.BUCKETS+('+Inf',),m['buckets']):
+        n += count
+        le = 'le="%s"' % bound
+        lines.append('xbmc_rpc_latency_seconds_bucket{%s,%s} %i' %
+            (self.labels(method),le,n))
+      lines.append('xbmc_rpc_latency_seconds_sum{%s} %f' %
+          (self.labels(method),m['seconds']))
+      lines.append('xbmc_rpc_latency_seconds_count{%s} %i' %
+          (self.labels(method),m['calls']))
+    return '\n'.join(lines)+'\n'
+
+  def labels(self,method):
+    """the host and method labels with values escaped"""
+
+    esc = lambda x: (x.replace('\\','\\\\').replace('"','\\"')
+                      .replace('\n','\\n'))
+    return 'host="%s",method="%s"' % (esc(self.host),esc(method))
+
+################################################################################
+# Controller class                                                             #
+################################################################################
+
+def player_action(func):
+  """decorator to retry a Controller action once if a cached player id failed"""
+
+  def wrapper(self,*args):
+    cached = self.pids.fresh()
+    try:
+      return func(self,*args)
+    except ResponseError:
+      if not cached:
+        raise
+      self.pids.invalidate()
+      return func(self,*args)
+  wrapper.__name__ = func.__name__
+  wrapper.__doc__ = func.__doc__
+  return wrapper
+
+class Controller(object):
+
+  def __init__(self,opts):
+    """connect to the XBMC described by opts; all actions live here"""
+
+    self.opts = opts
+    timeout = (float(opts['timeout_conn']),float(opts['timeout_read']))
+    self.conn = Connection(opts['xbmc_ip'],opts['xbmc_user'],opts['xbmc_pass'],
+        timeout,transport=opts.get('transport','get'),
+        tcp_port=int(opts['xbmc_tcp']))
+
+    # functions called with (method,data) for every notification, including
+    # Connection.OnUp and Connection.OnDown when the host comes and goes
+    self.listeners = []
+    self.conn.health.listeners.append(self.health_changed)
+
+    # remember the active player id for a short while, and the volume as
+    # last seen for as long
+    self.pids = PidCache(float(opts['pid_ttl']))
+    self.vol_seen = 0
+
+    # whether to use relative seek/volume commands, decided on first use
+    self.rel = None
+
+    # keep a local player state current from push notifications if enabled
+    self.state = PlayerState()
+    self.notifier = None
+    if int(opts['use_notify']):
+      self.notifier = Notifier(split_address(opts['xbmc_ip'])[1],
+          int(opts['xbmc_tcp']),self.state,self.conn,self.notified)
+      self.notifier.start()
+
+  def close(self):
+    """stop listening and close the connection"""
+
+    if self.notifier is not None:
+      self.notifier.stop()
+    self.conn.close()
+
+  def notified(self,method,data):
+    """called by the notifier after a notification was applied to the state"""
+
+    if method.startswith('Player.'):
+      self.pids.put(self.state.pid,self.state.media)
+    for func in self.listeners:
+      func(method,data)
+
+  def health_changed(self,connected):
+    """pass a change of the connection state on to the listeners"""
+
+    method = 'Connection.OnUp' if connected else 'Connection.OnDown'
+    for func in self.listeners:
+      func(method,{})
+
+  @player_action
+  def playpause(self):
+    """play/pause"""
+
+    # with a live state model the time is already known locally
+    st = self.state
+    if st.synced:
+      speed = self.xbmc('Player.PlayPause',{'playerid':st.pid})['speed']
+      st.set_speed(speed)
+      return self.playpause_msg(speed,sec2time(st.elapsed()),sec2time(st.total))
+
+    # execute method and get current time and total time in the same batch
+    pid = self.xpid()
+    params = {'playerid':pid,'properties':['time','totaltime']}
+    (result,props) = self.batch([('Player.PlayPause',{'playerid':pid}),
+                                 ('Player.GetProperties',params)])
+    speed = result['speed']
+    current = props['time']
+    total = props['totaltime']
+
+    # the answer also brings the local clock up to date for free
+    with st.lock:
+      st.total = time2sec(total)
+      st.set_time(time2sec(current),speed)
+    return self.playpause_msg(speed,current,total)
+
+  def playpause_msg(self,speed,current,total):
+    """return the statusbar message for playpause()"""
+
+    if speed==0:
+      return 'Paused at %s / %s' % (time2str(current),time2str(total))
+    left = time2sec(total)-time2sec(current)
+    return 'Playing with %s / %s left' % (time2str(sec2time(left)),time2str(total))
+
+  def hop(self,d):
+    """hop slightly forward or backward in the video"""
+
+    x = int(self.opts['step_'+d])
+    if d=='back':
+      x = -x
+    return self.seek(x)
+
+  @player_action
+  def seek(self,x):
+    """seek x seconds forward, or backward if x is negative"""
+
+    st = self.state
+
+    # let XBMC seek relative to the current time and report where it ended up
+    if self.relative():
+      pid = st.pid if st.synced else self.xpid()
+      params = {'playerid':pid,'value':{'seconds':x}}
+      t = time2sec(self.xbmc('Player.Seek',params)['time'])
+
+    # otherwise get current time and total time, from the state model if we
+    # have one, and seek to an absolute time
+    else:
+      if st.synced:
+        (pid,t,total) = (st.pid,st.elapsed(),st.total)
+      else:
+        pid = self.xpid()
+        params = {'playerid':pid,'properties':['time','totaltime']}
+        result = self.xbmc('Player.GetProperties',params)
+        t = time2sec(result['time'])
+        total = time2sec(result['totaltime'])
+
+      # limit t to [0,totaltime]
+      t = min(total,max(0,t+x))
+      self.xbmc('Player.Seek',{'playerid':pid,'value':sec2time(t)})
+
+    # return statusbar message
+    st.set_time(t)
+    return 'Seek to '+time2str(sec2time(t))
+
+  @player_action
+  def stop(self):
+    """stop playing"""
+    
+    pid = self.xpid()
+    result = self.xbmc('Player.Stop',{'playerid':pid})
+    self.pids.put(None)
+    with self.state.lock:
+      self.state.total = 0
+      self.state.set_time(0,0)
+    return 'Stopped'
+
+  @player_action
+  def jump(self,d):
+
+    # check playlist size, execute method and get the new position in one batch
+    pid = self.xpid()
+    to = {'prev':'previous','next':'next'}[d]
+    calls = [('Playlist.GetProperties',{'playlistid':pid,'properties':['size']}),
+             ('Player.GoTo',{'playerid':pid,'to':to}),
+             ('Player.GetProperties',{'playerid':pid,'properties':['position']})]
+    (siz,result,pos) = self.batch(calls,strict=False)
+    if isinstance(siz,XBMCException):
+      raise siz
+    siz = siz['size']
+
+    # an empty playlist makes 'next' fail, which is expected
+    if siz==0:
+      return {'prev':'Jumped to beginning','next':'No playlist'}[d]
+    for r in (result,pos):
+      if isinstance(r,XBMCException):
+        raise r
+
+    # return statusbar message
+    return 'Jumped to: %i / %i' % (pos['position']+1,siz)
+
+  def mute(self):
+    """mute/unmute"""
+    
+    result = self.xbmc('Application.SetMute',{'mute':'toggle'})
+    return {True:'Muted',False:'Unmuted'}[result]
+
+  def volume(self,d):
+    """adjust volume"""
+
+    return self.change_volume({'down':-5,'up':5}[d])
+
+  def change_volume(self,d,vol=None):
+    """change the volume by d percent; vol is the current volume if known"""
+
+    # the volume is known from the state model, or for pid_ttl seconds after
+    # we last saw it, so presses in a row take one request each
+    st = self.state
+    if vol is None and (st.synced or time.time()-self.vol_seen<self.pids.ttl):
+      vol = st.volume
+
+    # otherwise get the current volume first; XBMC's increment would be one
+    # request too, but it moves by XBMC's own step instead of d
+    if vol is None:
+      params = {'properties':['volume']}
+      vol = self.xbmc('Application.GetProperties',params)['volume']
+
+    # limit vol to [0,100] and execute method
+    vol = min(100,max(0,vol+d))
+    vol = self.xbmc('Application.SetVolume',{'volume':vol})
+    st.volume = vol
+    self.vol_seen = time.time()
+    return 'Volume: '+str(vol)+'%'
+
+  def relative(self):
+    """return True if single-request relative seek commands can be used"""
+
+    # Player.Seek takes relative seconds since JSON-RPC v10 (Kodi 18); older
+    # servers, or rel_cmds = 0, get the read-then-write path
+    # the answer is only kept once known, so a failed check is tried again
+    if self.rel is None:
+      if not int(self.opts['rel_cmds']):
+        self.rel = False
+      else:
+        version = self.xbmc('JSONRPC.Version')['version']
+        self.rel = version['major']>=10
+    return self.rel
+
+  def xbmc(self,method,params=None):
+    """make a request to the XBMC JSON-RPC web interface"""
+
+    return self.conn.request(method,params)
+
+  def batch(self,calls,strict=True):
+    """send several (method,params) requests to XBMC in one round trip"""
+
+    return self.conn.batch(calls,strict)
+
+  def xpid(self):
+    """helper method to get the id of the currently active player"""
+
+    # returns any of [None,0,1,2], from the cache if it is fresh
+    return self.pids.get(lambda: self.xbmc('Player.GetActivePlayers'))
+
+  @player_action
+  def get_info(self):
+    """return relevant info about the currently playing item in XBMC"""
+
+    # we will return an OrderedDict to keep them in order
+    info = odict()
+
+    # with a live state model only the item and position need to be fetched
+    st = self.state
+    if st.synced:
+      if st.pid is None:
+        return {'Info':'Nothing playing.'}
+      (pid,media) = (st.pid,st.media)
+      calls = [('Player.GetItem',{'playerid':pid,'properties':['artist','album']}),
+               ('Player.GetProperties',{'playerid':pid,'properties':['position']})]
+      (result,props) = self.batch(calls)
+      props.update({'speed':st.speed,'time':sec2time(st.elapsed()),
+                    'totaltime':sec2time(st.total)})
+      siz = st.sizes.get(pid,0)
+
+    # otherwise check if anything is playing and get everything else in a batch
+    else:
+      pid = self.xpid()
+      if pid is None:
+        return {'Info':'Nothing playing.'}
+      media = self.pids.media
+      names = ['speed','time','totaltime','position']
+      calls = [('Player.GetItem',{'playerid':pid,'properties':['artist','album']}),
+               ('Player.GetProperties',{'playerid':pid,'properties':names}),
+               ('Playlist.GetProperties',{'playlistid':pid,'properties':['size']})]
+      (result,props,plist) = self.batch(calls)
+      siz = plist['size']
+
+    # get artist and album
+    result = result['item']
+    info['Title'] = get(result,'label','Unknown')
+    artist = result.get('artist',['Unknown'])
+    if len(artist)==0 or artist[0].strip()=='':
+      artist = ['Unknown']
+    info['Artist'] = artist[0]
+    info['Album'] = get(result,'album','Unknown')
+
+    # get playerid and media type
+    info['Player ID'] = str(pid)
+    info['Media'] = media.title()
+
+    # get speed, time, and totaltime
+    info['Speed'] = {0:'Paused',1:'Playing'}[props['speed']]
+    info['Current Time'] = time2str(props['time'])
+    info['Total Time'] = time2str(props['totaltime'])
+
+    # get current position in playlist
+    info['Playlist'] = '%i / %i' % (props['position']+1,siz)
+
+    return info
+
+  @player_action
+  def now_playing(self):
+    """return the item playing now or None, and bring the state clock up to date"""
+
+    # with a live state model the clock is already current
+    st = self.state
+    art = {'properties':['thumbnail','fanart']}
+    if st.synced:
+      if st.pid is None:
+        return None
+      result = self.xbmc('Player.GetItem',dict(art,playerid=st.pid))
+      return result['item']
+
+    # otherwise fetch the item and its times in one batch and let the state
+    # extrapolate the time from here on, the way notifications would
+    pid = self.xpid()
+    if pid is None:
+      with st.lock:
+        st.total = 0
+        st.set_time(0,0)
+      return None
+    params = {'playerid':pid,'properties':['speed','time','totaltime']}
+    (result,props) = self.batch([('Player.GetItem',dict(art,playerid=pid)),
+                                 ('Player.GetProperties',params)])
+    with st.lock:
+      st.total = time2sec(props['totaltime'])
+      st.set_time(time2sec(props['time']),props['speed'])
+    return result['item']
+
+  @player_action
+  def get_playlist(self):
+    """return playlist id, size, position and shuffled info"""
+
+    # return empty values if nothing is playing
+    pid = self.xpid()
+    if pid is None:
+      return {'playlistid':None,'current':0,'size':0,'shuffled':False}
+
+    # get playlist size, position and shuffled state in one batch
+    calls = [('Playlist.GetProperties',{'playlistid':pid,'properties':['size']}),
+             ('Player.GetProperties',{'playerid':pid,
+                                      'properties':['position','shuffled']})]
+    (siz,props) = self.batch(calls)
+
+    # return empty values if there is no playlist
+    if siz['size']==0:
+      return {'playlistid':pid,'current':0,'size':0,'shuffled':False}
+    pos = props['position']+1
+
+    return {'playlistid':pid,'current':pos,'size':siz['size'],
+            'shuffled':props['shuffled']}
+
+  def get_items(self,plid,start,end):
+    """return playlist items [start,end) with the fields the dialog shows"""
+
+    return list(self.iter_items(plid,start,end))
+
+  def iter_items(self,plid,start,end):
+    """yield playlist items [start,end) as they are read off the socket"""
+
+    params = {'playlistid':plid,'properties':['title','file','album'],
+              'limits':{'start':start,'end':end}}
+    return self.conn.stream_items('Playlist.GetItems',params)
+
+  def enqueue(self,items):
+    """add library items, given as (kind,id), to the end of their playlists"""
+
+    calls = [('Playlist.Add',{'playlistid':LIBRARY[kind][3],
+                              'item':{kind+'id':i}}) for (kind,i) in items]
+    self.batch(calls)
+    return 'Queued %i item%s' % (len(items),'' if len(items)==1 else 's')
+
+  def macro(self,text):
+    """run a macro, sending its steps in as few batches as possible"""
+
+    try:
+      steps = compile_macro(text,int(self.opts['def_plist']))
+    except ValueError as e:
+      raise XBMCException(e.message)
+
+    # favourites are looked up by title before anything is sent
+    names = [s[3] for s in steps if s[3] is not None]
+    if names:
+      params = {'type':'media','properties':['path']}
+      found = self.xbmc('Favourites.GetFavourites',params)['favourites'] or []
+      paths = dict([(f['title'].lower(),f['path']) for f in found])
+      for name in names:
+        if name.lower() not in paths:
+          raise XBMCException('No favourite named "%s"' % name)
+
+    # every step goes into one batch, except that a step for the player after
+    # one that starts or stops it waits for the batch so far, which tells us
+    # the new player; steps for a player when nothing plays are skipped
+    (calls,commands,errors,ran,sent) = ([],[],[],0,0)
+    (pid,known,changed) = (None,False,False)
+    for (command,method,params,name) in steps:
+      if 'playerid' in params:
+        if changed:
+          errors += self.macro_batch(calls,commands)
+          (calls,commands,sent) = ([],[],sent+1)
+          (known,changed) = (False,False)
+        if not known:
+          (pid,known) = (self.xpid(),True)
+        if pid is None:
+          continue
+        params = dict(params,playerid=pid)
+      if name is not None:
+        params = {'item':{'file':paths[name.lower()]}}
+      if method in ('Player.Open','Player.Stop'):
+        self.pids.invalidate()
+        changed = True
+      calls.append((method,params))
+      commands.append(command)
+      ran += 1
+    if calls:
+      errors += self.macro_batch(calls,commands)
+      sent += 1
+
+    if errors:
+      raise XBMCException('; '.join(errors))
+    return 'Ran %i step%s in %i batch%s' % (ran,'' if ran==1 else 's',
+        sent,'' if sent==1 else 'es')
+
+  def macro_batch(self,calls,commands):
+    """send calls as one batch; return what went wrong as 'command: error'"""
+
+    results = self.batch(calls,strict=False)
+    return ['%s: %s' % (c,error_msg(r)) for (c,r) in zip(commands,results)
+            if isinstance(r,XBMCException)]
+
+################################################################################
+# Multiple hosts                                                               #
+################################################################################
+
+class ControllerGroup(object):
+
+  # the most hosts that are talked to at once
+  WORKERS = 8
+
+  def __init__(self,opts):
+    """a Controller for every configured host, all sharing the other options"""
+
+    self.ctrls = odict()
+    for (name,addr) in parse_hosts(opts).items():
+      host_opts = odict(opts)
+      host_opts['xbmc_ip'] = addr
+      self.ctrls[name] = Controller(host_opts)
+
+    # the thread pool for fan-out is only started when first needed
+    self.lock = threading.Lock()
+    self.pool = None
+
+  def close(self):
+    """close every controller and stop the thread pool"""
+
+    for ctrl in self.ctrls.values():
+      ctrl.close()
+    if self.pool is not None:
+      self.pool.terminate()
+
+  def call(self,method,args=(),names=None):
+    """call method on the named hosts (default all) at once; return results"""
+
+    # results are (name,result) in host order, with failures as the exception
+    names = names or list(self.ctrls)
+    if len(names)==1:
+      return [self.call_one(names[0],method,args)]
+    with self.lock:
+      if self.pool is None:
+        from multiprocessing.pool import ThreadPool
+        self.pool = ThreadPool(min(self.WORKERS,len(self.ctrls)))
+    return self.pool.map(lambda name: self.call_one(name,method,args),names)
+
+  def call_one(self,name,method,args):
+    """call a Controller method on one host and return (name,result)"""
+
+    try:
+      return (name,getattr(self.ctrls[name],method)(*args))
+    except XBMCException as e:
+      return (name,e)
+
+  def broadcast(self,method,args=()):
+    """call method on every host; return the status messages merged into one"""
+
+    results = [(name,error_msg(r) if isinstance(r,XBMCException) else r)
+               for (name,r) in self.call(method,args)]
+
+    # say it once if every host answered the same
+    if len(set([r for (name,r) in results]))==1:
+      return 'All: '+results[0][1]
+    return ' | '.join(['%s: %s' % r for r in results])
+
+################################################################################
+# Macros                                                                       #
+################################################################################
+
+# options starting with this are macros, steps separated by semicolons, e.g.
+#   macro_evening = stop; clear playlist; play Evening; volume 40
+MACRO = 'macro_'
+
+# playlist ids by name for "clear music" and the like; "clear playlist" and a
+# bare "play" use the def_plist option
+PLAYLISTS = {'music':0,'video':1,'pictures':2}
+
+# steps without an argument: (method,params); a playerid is replaced by the
+# active player's when the macro runs
+STEPS = {'pause'   : ('Player.PlayPause',{'playerid':None}),
+         'stop'    : ('Player.Stop',{'playerid':None}),
+         'next'    : ('Player.GoTo',{'playerid':None,'to':'next'}),
+         'prev'    : ('Player.GoTo',{'playerid':None,'to':'previous'}),
+         'shuffle' : ('Player.SetShuffle',{'playerid':None,'shuffle':'toggle'}),
+         'mute'    : ('Application.SetMute',{'mute':'toggle'}),
+         'party'   : ('Player.Open',{'item':{'partymode':'music'}})}
+
+def macros(opts):
+  """return an odict of macro names to their text from the options"""
+
+  return odict([(k[len(MACRO):],v) for (k,v) in opts.items()
+                if k.startswith(MACRO)])
+
+def compile_macro(text,plid=0):
+  """return the steps of a macro as (command,method,params,favourite) tuples;
+  raise ValueError for a step that is not understood"""
+
+  steps = []
+  for command in text.split(';'):
+    words = command.split()
+    if not words:
+      continue
+    command = ' '.join(words)
+    (verb,args,favourite) = (words[0].lower(),words[1:],None)
+
+    if verb in STEPS and not args:
+      (method,params) = STEPS[verb]
+    elif verb=='volume' and len(args)==1 and args[0].isdigit():
+      (method,params) = ('Application.SetVolume',{'volume':min(100,int(args[0]))})
+    elif verb=='clear' and len(args)<2:
+      name = args[0].lower() if args else 'playlist'
+      if name!='playlist' and name not in PLAYLISTS:
+        raise ValueError('unknown playlist: %s' % command)
+      (method,params) = ('Playlist.Clear',{'playlistid':PLAYLISTS.get(name,plid)})
+
+    # play starts a playlist, a path (directories end in a slash) or the
+    # favourite with that title
+    elif verb=='play':
+      target = ' '.join(args)
+      if not target:
+        item = {'playlistid':plid,'position':0}
+      elif target.lower() in PLAYLISTS:
+        item = {'playlistid':PLAYLISTS[target.lower()],'position':0}
+      elif '/' in target or ':' in target:
+        item = {('directory' if target.endswith('/') else 'file'):target}
+      else:
+        (item,favourite) = ({},target)
+      (method,params) = ('Player.Open',{'item':item})
+    else:
+      raise ValueError('unknown macro step: %s' % command)
+    steps.append((command,method,params,favourite))
+
+  if not steps:
+    raise ValueError('empty macro')
+  return steps
+
+################################################################################
+# Discovery                                                                    #
+################################################################################
+
+def discover(network,ports,user='',pw='',timeout=0.5,workers=64):
+  """probe every address and port at once; yield (address,status) as they finish"""
+
+  # status is what probe() returns, so None if nothing answered
+  targets = ['%s:%i' % (addr,port) for addr in parse_network(network)
+             for port in parse_ports(ports)]
+
+  # the pool is stopped when the caller is done, even if it stops early
+  from multiprocessing.pool import ThreadPool
+  pool = ThreadPool(min(workers,len(targets)) or 1)
+  try:
+    for result in pool.imap_unordered(
+        lambda target: (target,probe(target,user,pw,timeout)),targets):
+      yield result
+  finally:
+    pool.terminate()
+
+def probe(target,user='',pw='',timeout=0.5):
+  """return 'OK' if target answers JSONRPC.Ping or None if it does not"""
+
+  # closed and silent ports are weeded out without the cost of HTTP
+  (host,port) = target.rsplit(':',1)
+  try:
+    socket.create_connection((host,int(port)),timeout).close()
+  except socket.error:
+    return None
+
+  # a wrong password still means XBMC is there, so that error is returned
+  conn = Connection(target,user,pw,(timeout,timeout),pool=1)
+  try:
+    return 'OK' if conn.request('JSONRPC.Ping')=='pong' else None
+  except XBMCException as e:
+    return error_msg(e) if error_msg(e).startswith('HTTP 401') else None
+  finally:
+    conn.close()
+
+def parse_network(network):
+  """return the host addresses in a network like 192.168.1.0/24"""
+
+  # the network and broadcast addresses are skipped for anything but a /31+
+  (addr,bits) = (network.split('/',1)+['32'])[:2]
+  bits = int(bits)
+  if not 16<=bits<=32:
+    raise ValueError('network must be between /16 and /32')
+  try:
+    base = struct.unpack('!I',socket.inet_aton(addr.strip()))[0]
+  except socket.error:
+    raise ValueError('invalid address: %s' % addr)
+  size = 1<<(32-bits)
+  base &= ~(size-1)
+  (first,last) = (0,size) if size<=2 else (1,size-1)
+  return [socket.inet_ntoa(struct.pack('!I',base+i)) for i in range(first,last)]
+
+def parse_ports(ports):
+  """return the ports in a list like 80,8080-8082"""
+
+  result = []
+  for part in str(ports).split(','):
+    (lo,hi) = (part.split('-',1)+[None])[:2]
+    result.extend(range(int(lo),int(hi or lo)+1))
+  if not result or not all([0<p<65536 for p in result]):
+    raise ValueError('invalid ports: %s' % ports)
+  return result
+
+def local_network():
+  """guess the /24 network of this machine's LAN address"""
+
+  # connecting a UDP socket picks the outgoing interface without sending
+  sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+  try:
+    sock.connect(('192.0.2.1',9))
+    addr = sock.getsockname()[0]
+  except socket.error:
+    addr = '192.168.1.0'
+  finally:
+    sock.close()
+  return addr.rsplit('.',1)[0]+'.0/24'
+
+################################################################################
+# Library index                                                                #
+################################################################################
+
+# library item kinds mapped to (list method,result key,properties,playlist
+# id); ids are in the field kind+'id', and kinds with a dateadded property
+# are synced incrementally
+LIBRARY = odict([
+    ('artist',('AudioLibrary.GetArtists','artists',[],0)),
+    ('album',('AudioLibrary.GetAlbums','albums',['artist','year','dateadded'],0)),
+    ('song',('AudioLibrary.GetSongs','songs',['artist','album','dateadded'],0)),
+    ('movie',('VideoLibrary.GetMovies','movies',['year','dateadded'],1)),
+    ('episode',('VideoLibrary.GetEpisodes','episodes',
+                ['showtitle','season','episode','dateadded'],1))])
+
+# every word of an item's label and detail points back at the item, so a
+# search is one range scan of the words index per word typed
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (kind TEXT,id INTEGER,label TEXT,detail TEXT,
+                                  PRIMARY KEY (kind,id));
+CREATE TABLE IF NOT EXISTS words (word TEXT,kind TEXT,id INTEGER);
+CREATE INDEX IF NOT EXISTS words_word ON words (word);
+CREATE INDEX IF NOT EXISTS words_item ON words (kind,id);
+CREATE TABLE IF NOT EXISTS synced (kind TEXT PRIMARY KEY,added TEXT);
+'''
+
+def library_path(host,conf=CONFIG):
+  """the index file for host, next to the config file conf"""
+
+  return os.path.join(os.path.dirname(os.path.abspath(conf)),
+      'library-%s.db' % re.sub(r'[^\w.-]+','_',host))
+
+class Library(object):
+
+  # items per request while syncing, search results returned at most, and
+  # how far the words of a search are counted to find the rarest
+  PAGE = 2000
+  LIMIT = 200
+  RARE = 5000
+
+  def __init__(self,path):
+    """a local SQLite index of the XBMC media library, stored at path"""
+
+    # syncs run on worker threads while searches run on the GUI thread
+    self.lock = threading.RLock()
+    self.db = sqlite3.connect(path,check_same_thread=False)
+    self.db.executescript(SCHEMA)
+    self.scanning = False
+
+  def close(self):
+    """close the database"""
+
+    with self.lock:
+      self.db.close()
+
+  def search(self,text,kind=None,limit=LIMIT):
+    """return (kind,id,label,detail) of items with words starting as in text"""
+
+    words = set(split_words(text))
+    if not words:
+      return []
+    with self.lock:
+
+      # scan the range of the rarest word, counted up to a point, and check
+      # the other words among the few of each item it finds
+      count = ('SELECT COUNT(*) FROM (SELECT 1 FROM words WHERE word>=? AND '
+               'word<? LIMIT %i)' % self.RARE)
+      words = sorted(words,key=lambda w: (self.db.execute(count,
+          (w,w+u'\uffff')).fetchone()[0],len(w)))
+      sql = ('SELECT DISTINCT i.kind,i.id,i.label,i.detail FROM words w '
+             'JOIN items i ON i.kind=w.kind AND i.id=w.id '
+             'WHERE w.word>=? AND w.word<?')
+      args = [words[0],words[0]+u'\uffff']
+      if kind is not None:
+        sql += ' AND w.kind=?'
+        args.append(kind)
+      for word in words[1:]:
+        sql += (' AND EXISTS (SELECT 1 FROM words x WHERE x.kind=w.kind AND '
+                'x.id=w.id AND x.word>=? AND x.word<?)')
+        args += [word,word+u'\uffff']
+      return self.db.execute(sql+' LIMIT ?',args+[limit]).fetchall()
+
+  def counts(self):
+    """return the number of items of every kind"""
+
+    with self.lock:
+      rows = self.db.execute('SELECT kind,COUNT(*) FROM items GROUP BY kind')
+      counts = dict(rows.fetchall())
+    return odict([(kind,counts.get(kind,0)) for kind in LIBRARY])
+
+  def sync(self,conn):
+    """bring the index up to date; return the number of items fetched"""
+
+    # the totals of every kind take one round trip and tell us if items
+    # were removed while we were not listening
+    calls = [(method,{'limits':{'start':0,'end':1}})
+             for (method,key,props,plid) in LIBRARY.values()]
+    totals = [r['limits']['total'] for r in conn.batch(calls)]
+    with self.lock:
+      added = dict(self.db.execute('SELECT kind,added FROM synced').fetchall())
+
+    # fetch what was added since the last sync, or everything if that does
+    # not leave us with the same number of items
+    n = 0
+    for (kind,total) in zip(LIBRARY,totals):
+      since = added.get(kind)
+      if since and 'dateadded' in LIBRARY[kind][2]:
+        n += self.fetch(conn,kind,since)
+      if self.counts()[kind]!=total:
+        n += self.fetch(conn,kind)
+    return n
+
+  def fetch(self,conn,kind,since=None):
+    """store the items of a kind added after since, or all of them"""
+
+    (method,key,props,plid) = LIBRARY[kind]
+    params = {'properties':props}
+    if 'dateadded' in props:
+      params['sort'] = {'method':'dateadded','order':'ascending'}
+
+    # step back a second so items added in the second of the last sync are
+    # not missed; storing them again does no harm
+    if since is not None:
+      t = time.mktime(time.strptime(since,'%Y-%m-%d %H:%M:%S'))-1
+      params['filter'] = {'field':'dateadded','operator':'after',
+          'value':time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(t))}
+
+    # fetch in pages, each streamed in and stored in one transaction
+    (start,seen) = (0,set())
+    while True:
+      params['limits'] = {'start':start,'end':start+self.PAGE}
+      items = list(conn.stream_items(method,params,key))
+      self.store(kind,items)
+      seen.update([x[kind+'id'] for x in items])
+      start += len(items)
+      if len(items)<self.PAGE:
+        break
+
+    # a full fetch also tells us which items are gone
+    if since is None:
+      with self.lock:
+        rows = self.db.execute('SELECT id FROM items WHERE kind=?',(kind,))
+        gone = [i for (i,) in rows.fetchall() if i not in seen]
+      self.remove(kind,gone)
+    return start
+
+  def store(self,kind,items):
+    """add or replace items of a kind and remember the newest dateadded"""
+
+    (rows,words,ids) = ([],[],[])
+    for x in items:
+      i = x[kind+'id']
+      (label,detail) = (x.get('label',''),item_detail(kind,x))
+      rows.append((kind,i,label,detail))
+      words += [(w,kind,i) for w in set(split_words(label+' '+detail))]
+      ids.append((kind,i))
+    added = max([x.get('dateadded','') for x in items] or [''])
+    with self.lock:
+      with self.db:
+        self.db.executemany('DELETE FROM words WHERE kind=? AND id=?',ids)
+        self.db.executemany('INSERT OR REPLACE INTO items VALUES (?,?,?,?)',
+            rows)
+        self.db.executemany('INSERT INTO words VALUES (?,?,?)',words)
+        old = self.db.execute('SELECT added FROM synced WHERE kind=?',
+            (kind,)).fetchone()
+        if added and (old is None or old[0]<added):
+          self.db.execute('INSERT OR REPLACE INTO synced VALUES (?,?)',
+              (kind,added))
+
+  def remove(self,kind,ids):
+    """drop items of a kind from the index"""
+
+    rows = [(kind,i) for i in ids]
+    with self.lock:
+      with self.db:
+        self.db.executemany('DELETE FROM words WHERE kind=? AND id=?',rows)
+        self.db.executemany('DELETE FROM items WHERE kind=? AND id=?',rows)
+
+  def apply(self,conn,method,data):
+    """follow a library notification, fetching what changed"""
+
+    # a scan sends an update per item, so wait for it to end and sync once
+    if method.endswith('.OnScanStarted'):
+      self.scanning = True
+      return
+    if method.endswith('.OnScanFinished'):
+      self.scanning = False
+      self.sync(conn)
+      return
+
+    # the item is in data itself or in data['item'] depending on the version
+    item = data.get('item',data) if isinstance(data,dict) else {}
+    (kind,i) = (item.get('type'),item.get('id'))
+    if kind not in LIBRARY or i is None:
+      return
+    if method.endswith('.OnRemove'):
+      self.remove(kind,[i])
+    elif method.endswith('.OnUpdate') and not self.scanning:
+      (method,key,props,plid) = LIBRARY[kind]
+      details = '%s.Get%sDetails' % (method.split('.')[0],kind.title())
+      result = conn.request(details,{kind+'id':i,'properties':props})
+      self.store(kind,[result[kind+'details']])
+
+def item_detail(kind,x):
+  """a line about a library item besides its label, e.g. artist and album"""
+
+  artist = ', '.join(x.get('artist',[]))
+  year = str(x['year']) if x.get('year') else ''
+  if kind=='album':
+    parts = [artist,year]
+  elif kind=='song':
+    parts = [artist,x.get('album','')]
+  elif kind=='movie':
+    parts = [year]
+  elif kind=='episode':
+    parts = [x.get('showtitle',''),
+             'S%02iE%02i' % (x.get('season',0),x.get('episode',0))]
+  else:
+    parts = []
+  return ' - '.join([p for p in parts if p])
+
+def split_words(text):
+  """the lowercase words of text, for indexing and searching"""
+
+  return re.findall(r'\w+',text.lower(),re.UNICODE)
+
+################################################################################
+# Artwork cache                                                                #
+################################################################################
+
+def art_path(conf=CONFIG):
+  """the directory downloaded artwork is kept in, next to the config file conf"""
+
+  return os.path.join(os.path.dirname(os.path.abspath(conf)),'art')
+
+# the artwork directory for the default config file
+ART = art_path()
+
+class ArtCache(object):
+
+  def __init__(self,directory=ART,memory=8<<20,disk=256<<20):
+    """artwork by XBMC art URL, the most recent in memory and the rest on disk"""
+
+    # both are bounded in bytes and drop the least recently used first; on
+    # disk the modification time says when a file was last used
+    self.directory = directory
+    self.limits = (memory,disk)
+    self.lock = threading.Lock()
+    self.memory = odict()
+    self.size = 0
+    self.disk = None
+    self.loading = {}
+    self.counts = {'memory':0,'disk':0,'download':0}
+
+  def get(self,conn,url):
+    """return the image data for an art URL, downloading it at most once"""
+
+    # wait for another thread that is already getting the same URL
+    with self.lock:
+      if url in self.memory:
+        data = self.memory.pop(url)
+        self.memory[url] = data
+        self.counts['memory'] += 1
+        return data
+      event = self.loading.get(url)
+      if event is None:
+        self.loading[url] = threading.Event()
+    if event is not None:
+      event.wait()
+      return self.get(conn,url)
+
+    # then try the disk and only then XBMC
+    try:
+      path = os.path.join(self.directory,
+          hashlib.sha1(url.encode('utf-8')).hexdigest())
+      if os.path.isfile(path):
+        with open(path,'rb') as f:
+          data = f.read()
+        os.utime(path,None)
+        self.counts['disk'] += 1
+      else:
+        details = conn.request('Files.PrepareDownload',{'path':url})['details']
+        data = conn.download(details['path'])
+        self.counts['download'] += 1
+        self.save(path,data)
+      self.remember(url,data)
+      return data
+    finally:
+      with self.lock:
+        self.loading.pop(url).set()
+
+  def remember(self,url,data):
+    """keep data in memory, dropping the least recently used beyond the limit"""
+
+    with self.lock:
+      self.memory[url] = data
+      self.size += len(data)
+      while self.size>self.limits[0] and len(self.memory)>1:
+        self.size -= len(self.memory.popitem(last=False)[1])
+
+  def save(self,path,data):
+    """write data to the disk cache, trimming it to its limit"""
+
+    # write under a temporary name so a reader never sees half a file
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    with open(path+'.part','wb') as f:
+      f.write(data)
+    os.rename(path+'.part',path)
+
+    # the total is counted once, then kept up to date
+    with self.lock:
+      if self.disk is None:
+        self.disk = sum([os.path.getsize(os.path.join(self.directory,x))
+                         for x in os.listdir(self.directory)])
+      else:
+        self.disk += len(data)
+      if self.disk<=self.limits[1]:
+        return
+      files = [os.path.join(self.directory,x) for x in os.listdir(self.directory)]
+      files.sort(key=os.path.getmtime)
+      for f in files:
+        if self.disk<=self.limits[1]*0.9 or f==path:
+          break
+        self.disk -= os.path.getsize(f)
+        os.remove(f)
+
+  def __str__(self):
+    """hit counts, e.g. for a tooltip"""
+
+    return ('Art: %(memory)i from memory, %(disk)i from disk, '
+            '%(download)i downloaded' % self.counts)
+
+################################################################################
+# Input coalescer                                                              #
+################################################################################
+
+class Coalescer(object):
+
+  def __init__(self,ctrl):
+    """merge seek and volume presses that arrive while a request is in flight"""
+
+    self.ctrl = ctrl
+    self.lock = threading.Lock()
+    self.pending = {'seek':0,'volume':0}
+    self.busy = {'seek':False,'volume':False}
+
+  def press(self,kind,delta):
+    """add a delta; return True if the caller must start flush(kind)"""
+
+    with self.lock:
+      self.pending[kind] += delta
+      if self.busy[kind]:
+        return False
+      self.busy[kind] = True
+      return True
+
+  def flush(self,kind):
+    """send the net delta until nothing is pending; run this on a worker"""
+
+    msg = None
+    vol = None
+    while True:
+      with self.lock:
+        d = self.pending[kind]
+        self.pending[kind] = 0
+        if d==0:
+          self.busy[kind] = False
+          return msg
+
+      # later rounds know the volume from the previous response
+      try:
+        if kind=='seek':
+          msg = self.ctrl.seek(d)
+        else:
+          msg = self.ctrl.change_volume(d,vol)
+          vol = self.ctrl.state.volume
+      except XBMCException:
+        with self.lock:
+          self.pending[kind] = 0
+          self.busy[kind] = False
+        raise
+
+################################################################################
+# Navigation command queue                                                     #
+################################################################################
+
+class CommandQueue(object):
+
+  # moves that may be collapsed when the queue is over its limit
+  MOVES = ('Input.Left','Input.Right','Input.Up','Input.Down')
+
+  def __init__(self,ctrl,depth=8):
+    """send commands in order, at most depth of them per request in flight"""
+
+    self.ctrl = ctrl
+    self.depth = depth
+    self.lock = threading.Lock()
+    self.queue = []
+    self.busy = False
+
+  def put(self,method,params=None):
+    """queue a call; return True if the caller must start drain()"""
+
+    with self.lock:
+      self.queue.append((method,params))
+      if len(self.queue)>self.depth:
+        self.collapse()
+      if self.busy:
+        return False
+      self.busy = True
+      return True
+
+  def collapse(self):
+    """drop the repeats in runs of the same directional move"""
+
+    calls = []
+    for c in self.queue:
+      if calls and c[0] in self.MOVES and calls[-1]==c:
+        continue
+      calls.append(c)
+    self.queue = calls
+
+  def drain(self):
+    """send queued calls as ordered batches until the queue is empty"""
+
+    while True:
+      with self.lock:
+        calls = self.queue[:self.depth]
+        del self.queue[:self.depth]
+        if not calls:
+          self.busy = False
+          return
+
+      # XBMC runs a batch in order, so one batch in flight keeps the order
+      try:
+        self.ctrl.batch(calls,strict=False)
+      except XBMCException:
+        with self.lock:
+          self.queue = []
+          self.busy = False
+        raise
+
+################################################################################
+# Player id cache                                                              #
+################################################################################
+
+class PidCache(object):
+
+  def __init__(self,ttl=2.0):
+    """cache the active player id for ttl seconds"""
+
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.invalidate()
+
+  def fresh(self):
+    """return True if the cached id can be used without asking XBMC"""
+
+    return time.time()-self.stamp<self.ttl
+
+  def get(self,fetch):
+    """return the cached id, calling fetch() for the active players if stale"""
+
+    with self.lock:
+      if self.fresh():
+        self.hits += 1
+        return self.pid
+      self.misses += 1
+    players = fetch()
+    if len(players)==0:
+      self.put(None)
+    else:
+      self.put(players[0]['playerid'],players[0]['type'])
+    return self.pid
+
+  def put(self,pid,media=None):
+    """store a known id, e.g. from a notification"""
+
+    with self.lock:
+      self.pid = pid
+      self.media = media
+      self.stamp = time.time()
+
+  def invalidate(self):
+    """forget the cached id"""
+
+    with self.lock:
+      self.pid = None
+      self.media = None
+      self.stamp = 0
+
+  def __str__(self):
+    """hit and miss counters"""
+
+    return 'Player id cache: %i hits / %i misses' % (self.hits,self.misses)
+
+################################################################################
+# Player state model                                                           #
+################################################################################
+
+class PlayerState(object):
+
+  # notification methods that leave us without a usable time or player id
+  RESYNC = ('Player.OnPlay','Player.OnResume','Player.OnAVStart')
+
+  # media types of the player ids, as Player.GetActivePlayers gives them
+  MEDIA = {0:'audio',1:'video',2:'picture'}
+
+  def __init__(self):
+    """create an empty model; it is only trusted once synced is True"""
+
+    self.lock = threading.RLock()
+    self.reset()
+
+  def reset(self):
+    """forget everything, e.g. after losing the notification socket"""
+
+    with self.lock:
+      self.synced = False
+      self.pid = None
+      self.media = None
+      self.item = None
+      self.speed = 0
+      self.time = 0
+      self.stamp = time.time()
+      self.total = 0
+      self.volume = None
+      self.muted = None
+      self.sizes = {}
+
+  def elapsed(self):
+    """return the current play time in seconds, extrapolated from the last sync"""
+
+    with self.lock:
+      t = self.time
+      if self.speed:
+        t += self.speed*(time.time()-self.stamp)
+      if self.total:
+        t = min(self.total,t)
+      return max(0,int(t))
+
+  def set_time(self,t,speed=None):
+    """record the play time (in seconds) as of now"""
+
+    with self.lock:
+      self.time = t
+      self.stamp = time.time()
+      if speed is not None:
+        self.speed = speed
+
+  def set_speed(self,speed):
+    """change speed without losing the time played so far"""
+
+    with self.lock:
+      self.set_time(self.elapsed(),speed)
+
+  def sync(self,conn):
+    """pull the complete state from XBMC"""
+
+    calls = [('Application.GetProperties',{'properties':['volume','muted']}),
+             ('Playlist.GetProperties',{'playlistid':0,'properties':['size']}),
+             ('Playlist.GetProperties',{'playlistid':1,'properties':['size']})]
+    (app,audio,video) = conn.batch(calls)
+    with self.lock:
+      self.volume = app['volume']
+      self.muted = app['muted']
+      self.sizes = {0:audio['size'],1:video['size']}
+    self.sync_player(conn)
+    self.synced = True
+
+  def sync_player(self,conn,pid=None):
+    """pull the active player id, speed and times from XBMC; with the player
+    id already known only its speed and times"""
+
+    media = self.MEDIA.get(pid)
+    if pid is None:
+      players = conn.request('Player.GetActivePlayers')
+      if len(players)==0:
+        with self.lock:
+          (self.pid,self.media,self.total) = (None,None,0)
+          self.set_time(0,0)
+        return
+      (pid,media) = (players[0]['playerid'],players[0]['type'])
+
+    params = {'playerid':pid,'properties':['speed','time','totaltime']}
+    result = conn.request('Player.GetProperties',params)
+    with self.lock:
+      self.pid = pid
+      self.media = media
+      self.total = time2sec(result['totaltime'])
+      self.set_time(time2sec(result['time']),result['speed'])
+
+  def apply(self,method,data):
+    """update the model from a notification; return True if the times, or
+    the player too when the notification does not name it, must be fetched"""
+
+    with self.lock:
+      player = data.get('player',{}) if isinstance(data,dict) else {}
+      item = data.get('item') if isinstance(data,dict) else None
+
+      # resuming the item we have only changes the speed; otherwise a new
+      # item started and its times are fetched from the player it names
+      if method in self.RESYNC:
+        pid = player.get('playerid')
+        if pid is not None and pid==self.pid and (method=='Player.OnResume'
+            or (method=='Player.OnPlay' and self.speed==0 and item==self.item)):
+          self.set_speed(player.get('speed',1))
+          return False
+        (self.pid,self.item) = (pid,item)
+        return True
+
+      if method=='Player.OnPause':
+        self.set_speed(0)
+      elif method=='Player.OnSpeedChanged':
+        self.set_speed(player.get('speed',self.speed))
+      elif method=='Player.OnStop':
+        (self.pid,self.media,self.item,self.total) = (None,None,None,0)
+        self.set_time(0,0)
+      elif method=='Player.OnSeek':
+        if 'time' in player:
+          self.set_time(time2sec(player['time']),player.get('speed'))
+      elif method=='Application.OnVolumeChanged':
+        self.volume = data['volume']
+        self.muted = data['muted']
+      elif method=='Playlist.OnAdd':
+        plid = data['playlistid']
+        self.sizes[plid] = self.sizes.get(plid,0)+1
+      elif method=='Playlist.OnRemove':
+        plid = data['playlistid']
+        self.sizes[plid] = max(0,self.sizes.get(plid,0)-1)
+      elif method=='Playlist.OnClear':
+        self.sizes[data['playlistid']] = 0
+    return False
+
+################################################################################
+# Notification listener                                                        #
+################################################################################
+
+class Notifier(threading.Thread):
+
+  # the notification categories we care about
+  SUBSCRIBE = {'notifications':{'player':True,'application':True,
+                                'playlist':True,'audiolibrary':True,
+                                'videolibrary':True}}
+
+  def __init__(self,host,port,state,conn,callback=None,retry=5):
+    """keep state current from the XBMC TCP notification socket"""
+
+    super(Notifier,self).__init__()
+    self.daemon = True
+    self.addr = (host.split(':')[0],port)
+    self.state = state
+    self.conn = conn
+    self.callback = callback
+    self.retry = retry
+    self.sock = None
+    self.stopped = False
+
+  def run(self):
+    """connect, sync, then apply notifications until stopped"""
+
+    while not self.stopped:
+      try:
+        self.listen()
+      except (socket.error,ValueError,XBMCException):
+        pass
+      self.state.reset()
+      if not self.stopped:
+        time.sleep(self.retry)
+
+  def listen(self):
+    """handle a single connection until it drops"""
+
+    self.sock = socket.create_connection(self.addr,self.conn.timeout[0])
+    self.sock.settimeout(None)
+    self.sock.sendall(json.dumps(call('JSONRPC.SetConfiguration',self.SUBSCRIBE)))
+
+    # sync only after connecting so no notification can slip through unseen,
+    # then tell listeners they may have missed some while disconnected
+    self.state.sync(self.conn)
+    if self.callback is not None:
+      self.callback('Notifier.OnConnect',{})
+    splitter = JSONSplitter()
+    while not self.stopped:
+      data = self.sock.recv(4096)
+      if not data:
+        break
+      for obj in splitter.feed(data):
+        if 'method' in obj and 'id' not in obj:
+          data = obj.get('params',{}).get('data',{})
+          if self.state.apply(obj['method'],data):
+            self.state.sync_player(self.conn,self.state.pid)
+          if self.callback is not None:
+            self.callback(obj['method'],data)
+    self.sock.close()
+
+  def stop(self):
+    """close the socket and let the thread exit"""
+
+    self.stopped = True
+    if self.sock is not None:
+      try:
+        self.sock.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+
+################################################################################
+# Stream decoder                                                               #
+################################################################################
+
+class JSONSplitter(object):
+
+  # the only characters that change nesting depth or string state
+  TOKENS = re.compile(r'[{}\[\]"\\]')
+
+  def __init__(self):
+    """split a stream of concatenated JSON values into decoded objects"""
+
+    self.buf = ''
+    self.pos = 0
+    self.depth = 0
+    self.instr = False
+
+  def feed(self,data):
+    """add data from the stream and return a list of complete objects"""
+
+    self.buf += data
+    objs = []
+    start = 0
+    i = self.pos
+    while True:
+      m = self.TOKENS.search(self.buf,i)
+      if m is None:
+        break
+      c = m.group()
+      i = m.end()
+
+      # inside a string only quotes and escapes matter
+      if self.instr:
+        if c=='\\':
+          if i>=len(self.buf):
+            i -= 1
+            break
+          i += 1
+        elif c=='"':
+          self.instr = False
+      elif c=='"':
+        self.instr = True
+      elif c in '{[':
+        self.depth += 1
+      elif c in '}]':
+        self.depth -= 1
+        if self.depth==0:
+          objs.append(json.loads(self.buf[start:i]))
+          start = i
+
+    # keep only the unfinished value for the next call
+    self.buf = self.buf[start:]
+    self.pos = i-start
+    if self.depth==0 and not self.instr:
+      self.buf = self.buf.lstrip()
+      self.pos = 0
+    return objs
+
+class ItemStream(object):
+
+  def __init__(self,path=('result','items')):
+    """decode the elements of one array in a JSON value as the value arrives"""
+
+    # the key of every open container, None for the outermost one and for
+    # those in arrays; the array we want is open while keys equals path
+    self.path = [None]+list(path)
+    self.keys = []
+    self.buf = ''
+    self.pos = 0
+    self.instr = False
+
+    # positions in buf: where the last string started and ended, to tell
+    # keys, and where the element being read started
+    self.quote = None
+    self.after = None
+    self.elem = None
+
+    # depth of the array while we are in it, and the value without its
+    # elements, which is all that is left to decode at the end
+    self.array = None
+    self.mark = 0
+    self.skeleton = []
+
+  def feed(self,data):
+    """add data from the stream and return a list of complete elements"""
+
+    self.buf += data
+    items = []
+    i = self.pos
+    while True:
+      m = JSONSplitter.TOKENS.search(self.buf,i)
+      if m is None:
+        i = len(self.buf)
+        break
+      (c,j) = (m.group(),m.start())
+      i = m.end()
+
+      # inside a string only quotes and escapes matter
+      if self.instr:
+        if c=='\\':
+          if i>=len(self.buf):
+            i -= 1
+            break
+          i += 1
+        elif c=='"':
+          (self.instr,self.after) = (False,i)
+        continue
+      if c=='"':
+        (self.instr,self.quote) = (True,j)
+        continue
+
+      # a container right after "key": belongs to that key
+      if c in '{[':
+        key = None
+        if self.after is not None and self.buf[self.after:j].strip()==':':
+          key = self.buf[self.quote+1:self.after-1]
+        if self.array==len(self.keys) and self.elem is None:
+          self.elem = j
+        self.keys.append(key)
+        if c=='[' and self.keys==self.path:
+          self.array = len(self.keys)
+          self.skeleton.append(self.buf[self.mark:i])
+
+      # an element is done when we are back at the depth of the array
+      else:
+        if c==']' and self.array==len(self.keys):
+          (self.array,self.mark) = (None,j)
+        self.keys.pop()
+        if self.array==len(self.keys) and self.elem is not None:
+          items.append(json.loads(self.buf[self.elem:i]))
+          self.elem = None
+      self.after = None
+
+    # keep only an unfinished element or string, or a possible key, and
+    # set aside what belongs to the skeleton
+    keep = i
+    pending = self.instr or self.after is not None
+    for x in (self.elem,self.quote if pending else None):
+      if x is not None:
+        keep = min(keep,x)
+    if self.array is None:
+      self.skeleton.append(self.buf[self.mark:keep])
+    self.buf = self.buf[keep:]
+    self.pos = i-keep
+    self.mark = 0
+    (self.quote,self.after,self.elem) = [x if x is None else x-keep
+        for x in (self.quote,self.after,self.elem)]
+    return items
+
+  def close(self):
+    """return the rest of the value, with the array empty, once it is complete"""
+
+    if self.keys or self.instr:
+      raise XBMCException('Truncated response')
+    self.skeleton.append(self.buf[self.mark:])
+    try:
+      return json.loads(''.join(self.skeleton))
+    except ValueError:
+      raise XBMCException('Bad response')
+
+################################################################################
+# Helper functions                                                             #
+################################################################################
+
+def get(x,k,d):
+  """get key k from dict d but return default d if it doesn't exist or empty"""
+  
+  v = x.get(k,d)
+  if len(v.strip())==0:
+    return d
+  return v
+
+def error_msg(e):
+  """the message of an exception, or its class name if it has none"""
+
+  return e.message or e.__class__.__name__
+
+def call(method,params=None,i=1):
+  """build a single JSON-RPC request object"""
+
+  p = {'jsonrpc':'2.0','id':i,'method':method}
+  if params is not None:
+    p['params'] = params
+  return p
+
+def time2sec(t):
+  """convert an xbmc time dict to seconds"""
+
+  return 3600*t['hours']+60*t['minutes']+t['seconds']
+
+def sec2time(t):
+  """convert seconds to an xbmc time dict"""
+
+  h = t/3600
+  t -= 3600*h
+  m = t/60
+  t -= 60*m
+  return {'hours':h,'minutes':m,'seconds':t}
+
+def time2str(t):
+  """convert an xbmc time dict to a string"""
+
+  s = ''
+  hr = str(t['hours'])
+  mi = str(t['minutes'])
+  sec = str(t['seconds'])
+  if t['hours']>0:
+    s += (hr+':')
+    s+= (mi.zfill(2)+':')
+  else:
+    s+= (mi+':')
+  s+= sec.zfill(2)
+  return s
@@ -0,0 +1,606 @@
+#!/usr/bin/env python
+
+import os,sys,json,argparse,random,socket,struct,threading,time,urllib,urlparse,zlib
+from BaseHTTPServer import HTTPServer,BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn,ThreadingTCPServer,BaseRequestHandler
+
+from xbmcrpc import JSONSplitter,time2sec,sec2time
+
+# Raised by method handlers to produce a JSON-RPC error response
+class RPCError(Exception):
+  pass
+
+################################################################################
+# Simulated XBMC instance                                                      #
+################################################################################
+
+class Sim(object):
+
+  def __init__(self,length=300,latency=0,jitter=0,failure=0,items=1,songs=0,
+      seed=None):
+    """a fake XBMC playing a video playlist with push notifications"""
+
+    self.lock = threading.RLock()
+    self.clients = []
+    self.random = random.Random(seed)
+    self.latency = latency
+    self.jitter = jitter
+    self.failure = failure
+    self.requests = 0
+    self.failed = 0
+    self.length = length
+    self.pid = 1
+    self.speed = 1
+    self.time = 0
+    self.stamp = time.time()
+    self.total = length
+    self.volume = 50
+    self.muted = False
+    self.fullscreen = False
+    self.inputs = []
+    self.downloads = 0
+    self.shuffled = False
+
+    # favourites play a file, like those made from XBMC's context menu
+    self.favourites = [{'title':'Favourites','type':'media',
+                        'path':'/media/favourites.m3u'}]
+
+    # playlist ids match player ids: 0 is audio and 1 is video
+    self.playlists = {0:[],1:[self.make_item(i) for i in range(items)]}
+    self.position = 0
+
+    # a media library with the given number of songs and the other kinds
+    # in proportion; every item is added a second after the one before
+    self.library = {'artist':[],'album':[],'song':[],'movie':[],'episode':[]}
+    self.added = time.mktime((2015,1,1,0,0,0,0,0,-1))
+    self.scan(songs)
+
+  def make_item(self,i):
+    """a playlist item for a made up file"""
+
+    return {'label':'item%i.mkv' % i,'title':'Item %i' % i,'artist':[],
+            'album':'','file':'/media/item%i.mkv' % i,'duration':self.length,
+            'thumbnail':'image://%%2fmedia%%2fitem%i.tbn/' % i,'fanart':''}
+
+  def scan(self,songs):
+    """add songs to the library, and artists, albums and videos to match"""
+
+    lib = self.library
+    for i in range(len(lib['song']),len(lib['song'])+songs):
+      if i%100==0:
+        self.add_entry('artist',{'label':'Artist %i' % (i/100)})
+      if i%10==0:
+        self.add_entry('album',{'label':'Album %i' % (i/10),
+            'artist':['Artist %i' % (i/100)],'year':1960+i/10%60})
+        self.add_entry('movie',{'label':'Movie %i' % (i/10),
+            'year':1960+i/10%60})
+      if i%5==0:
+        self.add_entry('episode',{'label':'Episode %i' % (i/5),
+            'showtitle':'Show %i' % (i/500),'season':i/50%10+1,
+            'episode':i/5%10+1})
+      self.add_entry('song',{'label':'Song %i' % i,
+          'artist':['Artist %i' % (i/100)],'album':'Album %i' % (i/10)})
+
+  def add_entry(self,kind,entry):
+    """add an item to the library with the next id and date"""
+
+    self.added += 1
+    entry[kind+'id'] = len(self.library[kind])+1
+    entry['dateadded'] = time.strftime('%Y-%m-%d %H:%M:%S',
+        time.localtime(self.added))
+    self.library[kind].append(entry)
+
+  def elapsed(self):
+    """current play time in seconds"""
+
+    t = self.time+self.speed*(time.time()-self.stamp)
+    return max(0,min(self.total,int(t)))
+
+  def set_time(self,t,speed=None):
+    """set the play time (in seconds) as of now"""
+
+    self.time = t
+    self.stamp = time.time()
+    if speed is not None:
+      self.speed = speed
+
+  def round_trip(self,req):
+    """count and answer a request that came in over the network"""
+
+    with self.lock:
+      self.requests += 1
+      delay = self.latency+self.random.uniform(0,self.jitter)
+    time.sleep(delay)
+    return self.handle(req)
+
+  def fail(self):
+    """decide if a request should be dropped, at the configured failure rate"""
+
+    with self.lock:
+      if self.random.random()>=self.failure:
+        return False
+      self.requests += 1
+      self.failed += 1
+      return True
+
+  def handle(self,req):
+    """answer a single JSON-RPC request object or a batch"""
+
+    if isinstance(req,list):
+      return [self.handle(r) for r in req]
+    resp = {'jsonrpc':'2.0','id':req.get('id')}
+    func = getattr(self,req['method'].replace('.','_'),None)
+    try:
+      if func is None:
+        raise RPCError('Method not found.')
+      with self.lock:
+        resp['result'] = func(req.get('params',{}))
+    except (RPCError,KeyError,TypeError) as e:
+      resp['error'] = {'code':-32602,'message':str(e) or 'Invalid params.'}
+    return resp
+
+  def player(self,params):
+    """check that the request names the active player"""
+
+    if self.pid is None or params['playerid']!=self.pid:
+      raise RPCError('Failed to execute method.')
+
+  def play(self,pos):
+    """start the item at pos in the active playlist from the beginning"""
+
+    self.position = pos
+    self.total = self.playlists[self.pid][pos]['duration']
+    self.set_time(0,1)
+    self.notify('Player.OnPlay',{'item':{'type':'movie'},
+                                 'player':self.player_data()})
+
+  ##############################################################################
+  # Notifications                                                              #
+  ##############################################################################
+
+  def notify(self,method,data):
+    """push a notification to every connected TCP client"""
+
+    msg = {'jsonrpc':'2.0','method':method,
+           'params':{'sender':'xbmc','data':data}}
+    for client in list(self.clients):
+      client.send(msg)
+
+  def player_data(self):
+    """the 'player' field sent with Player notifications"""
+
+    return {'playerid':self.pid,'speed':self.speed}
+
+  ##############################################################################
+  # JSON-RPC methods                                                           #
+  ##############################################################################
+
+  def JSONRPC_Ping(self,params):
+    return 'pong'
+
+  def JSONRPC_SetConfiguration(self,params):
+    return params
+
+  def JSONRPC_Version(self,params):
+    return {'version':{'major':12,'minor':0,'patch':0}}
+
+  def Player_GetActivePlayers(self,params):
+    if self.pid is None:
+      return []
+    return [{'playerid':self.pid,'type':'video'}]
+
+  def Player_GetProperties(self,params):
+    self.player(params)
+    props = {'speed':self.speed,'time':sec2time(self.elapsed()),
+             'totaltime':sec2time(self.total),'position':self.position,
+             'playlistid':self.pid,'shuffled':self.shuffled}
+    return dict([(k,props[k]) for k in params['properties']])
+
+  def Player_GetItem(self,params):
+    self.player(params)
+    plist = self.playlists[self.pid]
+    if not plist:
+      return {'item':{'label':'Simulated Video','artist':[],'album':''}}
+    item = plist[self.position]
+    keys = ['label','artist','album']+params.get('properties',[])
+    return {'item':dict([(k,item[k]) for k in keys if k in item])}
+
+  def Player_PlayPause(self,params):
+    self.player(params)
+    self.set_time(self.elapsed(),1-self.speed)
+    self.notify({0:'Player.OnPause',1:'Player.OnPlay'}[self.speed],
+                {'item':{'type':'movie'},'player':self.player_data()})
+    return {'speed':self.speed}
+
+  def Player_GoTo(self,params):
+    self.player(params)
+    step = {'next':1,'previous':-1}
+    to = params['to']
+    pos = self.position+step[to] if to in step else to
+    if not 0<=pos<len(self.playlists[self.pid]):
+      raise RPCError('Failed to execute method.')
+    self.play(pos)
+    return 'OK'
+
+  def Player_Open(self,params):
+    item = params['item']
+    if 'playlistid' in item:
+      plid = item['playlistid']
+      if not self.playlists.get(plid):
+        raise RPCError('Failed to execute method.')
+      (self.pid,pos) = (plid,item.get('position',0))
+    elif 'partymode' in item:
+      self.playlists[0] = [self.make_item(i) for i in range(10)]
+      (self.pid,pos) = (0,0)
+    else:
+      path = item.get('file') or item['directory']
+      entry = self.make_item(0)
+      entry.update({'label':os.path.basename(path.rstrip('/')),'file':path})
+      self.playlists[1] = [entry]
+      (self.pid,pos) = (1,0)
+    self.play(pos)
+    return 'OK'
+
+  def Player_SetShuffle(self,params):
+    self.player(params)
+    shuffle = params['shuffle']
+    self.shuffled = not self.shuffled if shuffle=='toggle' else shuffle
+    return 'OK'
+
+  def Player_Stop(self,params):
+    self.player(params)
+    self.pid = None
+    self.set_time(0,0)
+    self.notify('Player.OnStop',{'end':False,'item':{'type':'movie'}})
+    return 'OK'
+
+  def Player_Seek(self,params):
+    self.player(params)
+    old = self.elapsed()
+    value = params['value']
+    if 'seconds' in value:
+      t = old+value['seconds']
+    elif 'percentage' in value:
+      t = int(self.total*value['percentage']/100.0)
+    else:
+      t = time2sec(value.get('time',value))
+    self.set_time(min(self.total,max(0,t)))
+    data = self.player_data()
+    data.update({'time':sec2time(self.time),
+                 'seekoffset':sec2time(abs(self.time-old))})
+    self.notify('Player.OnSeek',{'item':{'type':'movie'},'player':data})
+    return {'time':sec2time(self.time),'totaltime':sec2time(self.total)}
+
+  def Application_GetProperties(self,params):
+    props = {'volume':self.volume,'muted':self.muted}
+    return dict([(k,props[k]) for k in params['properties']])
+
+  def Application_SetVolume(self,params):
+    step = {'increment':2,'decrement':-2}
+    vol = params['volume']
+    vol = self.volume+step[vol] if vol in step else int(vol)
+    self.volume = min(100,max(0,vol))
+    self.notify('Application.OnVolumeChanged',
+                {'volume':self.volume,'muted':self.muted})
+    return self.volume
+
+  def Application_SetMute(self,params):
+    self.muted = not self.muted if params['mute']=='toggle' else params['mute']
+    self.notify('Application.OnVolumeChanged',
+                {'volume':self.volume,'muted':self.muted})
+    return self.muted
+
+  def Playlist_GetProperties(self,params):
+    return {'size':len(self.playlists[params['playlistid']])}
+
+  def Playlist_GetItems(self,params):
+    plist = self.playlists[params['playlistid']]
+    limits = params.get('limits',{})
+    start = limits.get('start',0)
+    end = min(len(plist),limits.get('end',len(plist)))
+    keys = ['label']+params.get('properties',[])
+    items = [dict([(k,item[k]) for k in keys]) for item in plist[start:end]]
+    return {'items':items,'limits':{'start':start,'end':end,'total':len(plist)}}
+
+  def Playlist_Add(self,params):
+    plid = params['playlistid']
+    plist = self.playlists[plid]
+    item = self.make_item(len(plist))
+    item.update(params.get('item',{}))
+    plist.append(item)
+    self.notify('Playlist.OnAdd',{'playlistid':plid,'position':len(plist)-1,
+                                  'item':{'type':'movie'}})
+    return 'OK'
+
+  def Playlist_Remove(self,params):
+    plid = params['playlistid']
+    pos = params['position']
+    if pos>=len(self.playlists[plid]) or (plid==self.pid and pos==self.position):
+      raise RPCError('Invalid params.')
+    del self.playlists[plid][pos]
+    if plid==self.pid and pos<self.position:
+      self.position -= 1
+    self.notify('Playlist.OnRemove',{'playlistid':plid,'position':pos})
+    return 'OK'
+
+  def Playlist_Clear(self,params):
+    plid = params['playlistid']
+    self.playlists[plid] = []
+    self.notify('Playlist.OnClear',{'playlistid':plid})
+    return 'OK'
+
+  ##############################################################################
+  # Library methods                                                            #
+  ##############################################################################
+
+  def entries(self,kind,key,params):
+    """answer a Get<Kind>s request with limits and a dateadded filter"""
+
+    entries = [x for x in self.library[kind] if x is not None]
+    where = params.get('filter')
+    if where is not None:
+      if (where['field'],where['operator'])!=('dateadded','after'):
+        raise RPCError('Invalid params.')
+      entries = [x for x in entries if x['dateadded']>where['value']]
+    limits = params.get('limits',{})
+    start = limits.get('start',0)
+    end = min(len(entries),limits.get('end',len(entries)))
+    keys = [kind+'id','label']+params.get('properties',[])
+    items = [dict([(k,x[k]) for k in keys if k in x]) for x in entries[start:end]]
+    return {key:items,'limits':{'start':start,'end':end,'total':len(entries)}}
+
+  def details(self,kind,params):
+    """answer a Get<Kind>Details request"""
+
+    i = params[kind+'id']-1
+    if not 0<=i<len(self.library[kind]) or self.library[kind][i] is None:
+      raise RPCError('Invalid params.')
+    x = self.library[kind][i]
+    keys = [kind+'id','label']+params.get('properties',[])
+    return {kind+'details':dict([(k,x[k]) for k in keys if k in x])}
+
+  def AudioLibrary_GetArtists(self,params):
+    return self.entries('artist','artists',params)
+
+  def AudioLibrary_GetAlbums(self,params):
+    return self.entries('album','albums',params)
+
+  def AudioLibrary_GetSongs(self,params):
+    return self.entries('song','songs',params)
+
+  def VideoLibrary_GetMovies(self,params):
+    return self.entries('movie','movies',params)
+
+  def VideoLibrary_GetEpisodes(self,params):
+    return self.entries('episode','episodes',params)
+
+  def AudioLibrary_GetSongDetails(self,params):
+    return self.details('song',params)
+
+  def VideoLibrary_GetMovieDetails(self,params):
+    return self.details('movie',params)
+
+  def AudioLibrary_Scan(self,params):
+    self.notify('AudioLibrary.OnScanStarted',{})
+    self.scan(10)
+    self.notify('AudioLibrary.OnScanFinished',{})
+    return 'OK'
+
+  def VideoLibrary_RemoveMovie(self,params):
+    self.details('movie',params)
+    self.library['movie'][params['movieid']-1] = None
+    self.notify('VideoLibrary.OnRemove',{'type':'movie','id':params['movieid']})
+    return 'OK'
+
+  def Favourites_GetFavourites(self,params):
+    keys = ['title','type']+params.get('properties',[])
+    found = [dict([(k,f[k]) for k in keys if k in f]) for f in self.favourites
+             if params.get('type') in (None,f['type'])]
+    return {'favourites':found or None,
+            'limits':{'start':0,'end':len(found),'total':len(found)}}
+
+  def Files_PrepareDownload(self,params):
+    path = 'vfs/'+urllib.quote(params['path'],'')
+    return {'details':{'path':path},'mode':'redirect','protocol':'http'}
+
+  def GUI_SetFullscreen(self,params):
+    full = params['fullscreen']
+    self.fullscreen = not self.fullscreen if full=='toggle' else full
+    return self.fullscreen
+
+  ##############################################################################
+  # Input methods only record what was pressed                                 #
+  ##############################################################################
+
+  def input(self,name,params):
+    """remember an input action"""
+
+    self.inputs.append((name,params))
+    return 'OK'
+
+  def Input_Left(self,params):
+    return self.input('left',params)
+
+  def Input_Right(self,params):
+    return self.input('right',params)
+
+  def Input_Up(self,params):
+    return self.input('up',params)
+
+  def Input_Down(self,params):
+    return self.input('down',params)
+
+  def Input_Select(self,params):
+    return self.input('select',params)
+
+  def Input_Back(self,params):
+    return self.input('back',params)
+
+  def Input_ContextMenu(self,params):
+    return self.input('contextmenu',params)
+
+  def Input_ExecuteAction(self,params):
+    return self.input(params['action'],params)
+
+  def Input_SendText(self,params):
+    return self.input('text',params)
+
+################################################################################
+# HTTP and TCP front ends                                                      #
+################################################################################
+
+class HTTPHandler(BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+  wbufsize = -1
+
+  def do_GET(self):
+    """JSON-RPC over GET with the request in the query string"""
+
+    if self.path.startswith('/vfs/'):
+      self.image()
+      return
+    query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+    self.reply(query['request'][0])
+
+  def do_POST(self):
+    """JSON-RPC over POST with the request as the body"""
+
+    self.reply(self.rfile.read(int(self.headers.getheader('content-length'))))
+
+  def reply(self,body):
+    """decode, dispatch and answer a request"""
+
+    sim = self.server.sim
+    if sim.fail():
+      self.send_error(503)
+      return
+    body = json.dumps(sim.round_trip(json.loads(body)))
+    self.send_response(200)
+    self.send_header('Content-Type','application/json')
+    self.send_header('Content-Length',str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def image(self):
+    """answer a file download with a small PNG"""
+
+    sim = self.server.sim
+    with sim.lock:
+      sim.downloads += 1
+    time.sleep(sim.latency)
+    body = png(64,64,hash(self.path)&0xffffff)
+    self.send_response(200)
+    self.send_header('Content-Type','image/png')
+    self.send_header('Content-Length',str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self,*args):
+    pass
+
+class TCPHandler(BaseRequestHandler):
+
+  def setup(self):
+    """register for notifications"""
+
+    self.lock = threading.Lock()
+    self.request.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    self.server.sim.clients.append(self)
+
+  def handle(self):
+    """answer requests until the client disconnects"""
+
+    splitter = JSONSplitter()
+    while True:
+      try:
+        data = self.request.recv(4096)
+      except socket.error:
+        break
+      if not data:
+        break
+      # the latency stands for the network, so pipelined requests overlap
+      for req in splitter.feed(data):
+        t = threading.Thread(target=self.answer,args=(req,))
+        t.daemon = True
+        t.start()
+
+  def answer(self,req):
+    """reply to one request"""
+
+    self.send(self.server.sim.round_trip(req))
+
+  def finish(self):
+    """unregister"""
+
+    self.server.sim.clients.remove(self)
+
+  def send(self,msg):
+    """write one JSON object to the socket"""
+
+    with self.lock:
+      try:
+        self.request.sendall(json.dumps(msg))
+      except socket.error:
+        pass
+
+def png(width,height,rgb):
+  """a PNG of one colour"""
+
+  def chunk(kind,data):
+    return (struct.pack('>I',len(data))+kind+data+
+            struct.pack('>I',zlib.crc32(kind+data)&0xffffffff))
+  pixel = struct.pack('>BBB',rgb>>16,(rgb>>8)&0xff,rgb&0xff)
+  rows = ('\0'+pixel*width)*height
+  return ('\x89PNG\r\n\x1a\n'+
+          chunk('IHDR',struct.pack('>IIBBBBB',width,height,8,2,0,0,0))+
+          chunk('IDAT',zlib.compress(rows))+chunk('IEND',''))
+
+class HTTPServerThreads(ThreadingMixIn,HTTPServer):
+  daemon_threads = True
+
+class TCPServerThreads(ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+def serve(sim,host,http,tcp):
+  """start the HTTP and TCP servers in background threads and return them"""
+
+  servers = [HTTPServerThreads((host,http),HTTPHandler),
+             TCPServerThreads((host,tcp),TCPHandler)]
+  for server in servers:
+    server.sim = sim
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+  return servers
+
+################################################################################
+# Main                                                                         #
+################################################################################
+
+def main(args):
+
+  parser = argparse.ArgumentParser(description='fake XBMC JSON-RPC server')
+  parser.add_argument('--host',default='127.0.0.1',help='address to bind')
+  parser.add_argument('--http',type=int,default=8080,help='HTTP port')
+  parser.add_argument('--tcp',type=int,default=9090,help='notification port')
+  parser.add_argument('--latency',type=float,default=0,help='delay per request (ms)')
+  parser.add_argument('--jitter',type=float,default=0,help='extra random delay (ms)')
+  parser.add_argument('--failure',type=float,default=0,help='HTTP failure rate (0-1)')
+  parser.add_argument('--items',type=int,default=1,help='video playlist size')
+  parser.add_argument('--songs',type=int,default=0,help='songs in the library')
+  args = parser.parse_args(args[1:])
+
+  sim = Sim(latency=args.latency/1000.0,jitter=args.jitter/1000.0,
+            failure=args.failure,items=args.items,songs=args.songs)
+  serve(sim,args.host,args.http,args.tcp)
+  print('Serving on %s (HTTP %i, TCP %i)' % (args.host,args.http,args.tcp))
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == '__main__':
+  main(sys.argv)